@@ -16,11 +16,19 @@ from kivy.uix.video import Video
 from kivy.uix.dropdown import DropDown
 from kivy.uix.popup import Popup
 from kivy.uix.image import Image
-from kivy.properties import NumericProperty, StringProperty
+from kivy.properties import BooleanProperty, ListProperty, NumericProperty, StringProperty
+from kivy.core.text import Label as CoreLabel
+from kivy.metrics import sp
 from kivy.utils import platform
 import os
-import json
-from datetime import datetime
+import threading
+from collections import OrderedDict
+from vpncore import CONFIG_FILE, DEFAULT_REGION, REGIONS, SESSION_FILE, ConfigDatabase, ConfigValidator, ConnectionManager, HealthMonitor, ServerCatalog, TaskScheduler, TrafficAccounting, VPNError, endpoints_for_region, flag_path, get_data_dir
+from vpncore.catalog import REGION, build_entries, server_key
+from vpncore.accounting import format_bytes
+from vpncore.control import DEFAULT_RELAY_PORT
+from vpncore.scheduler import IDLE, NORMAL, UI
+from vpncore.session import SessionStore, capture_session, restore_session
 
 # Настройка окна только для desktop
 if platform not in ('android', 'ios'):
@@ -28,56 +36,197 @@ if platform not in ('android', 'ios'):
 Window.clearcolor = (0, 0, 0, 1)
 
 
-def get_data_dir():
-    """Получает правильную директорию для данных в зависимости от платформы"""
+# Пути к ресурсам (относительные)
+VIDEO_PATH = os.path.join(get_data_dir(), "z-f.mp4")
+
+# Ниже этой частоты кадров некритичные задачи замедляются
+MIN_FPS = 30
+
+
+def is_battery_saver():
+    """Включен ли режим энергосбережения (Android) или батарея почти разряжена"""
     if platform == 'android':
-        from android.storage import app_storage_path
-        return app_storage_path()
-    else:
-        return os.path.dirname(os.path.abspath(__file__))
+        try:
+            from jnius import autoclass
+            activity = autoclass('org.kivy.android.PythonActivity').mActivity
+            context = autoclass('android.content.Context')
+            if activity.getSystemService(context.POWER_SERVICE).isPowerSaveMode():
+                return True
+        except Exception:
+            pass
+    try:
+        from plyer import battery
+        status = battery.status
+        return not status.get('isCharging', True) and status.get('percentage', 100) <= 20
+    except Exception:
+        return False
 
 
-# Пути к ресурсам (относительные)
-VIDEO_PATH = os.path.join(get_data_dir(), "z-f.mp4")
-CONFIG_FILE = os.path.join(get_data_dir(), "vpn_config.json")
+class LabelTextureCache:
+    """LRU-кэш растеризованного текста по (text, font, size, bold).
+
+    Текст растеризуется белым, цвет задает инструкция Color виджета: смена
+    цвета не создает новую текстуру, а text и color можно менять в любом порядке.
+    """
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.textures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, text, font_size, bold=False, font_name='Roboto'):
+        key = (text, font_name, round(font_size, 2), bold)
+        texture = self.textures.get(key)
+        if texture is not None:
+            self.hits += 1
+            self.textures.move_to_end(key)
+            return texture
+        self.misses += 1
+        label = CoreLabel(text=text, font_size=font_size, color=(1, 1, 1, 1), bold=bold, font_name=font_name)
+        label.refresh()
+        texture = label.texture
+        self.textures[key] = texture
+        while len(self.textures) > self.max_size:
+            self.textures.popitem(last=False)
+        return texture
+    
+    def prewarm(self, entries):
+        """entries: (text, font_size, bold)"""
+        for text, font_size, bold in entries:
+            self.get(text, font_size, bold)
+
 
+label_textures = LabelTextureCache()
 
-class ConfigDatabase:
-    """Класс для работы с конфигурацией VPN"""
-    def __init__(self, filepath):
-        self.filepath = filepath
-        self.config = self.load_config()
+
+class GlyphAtlas:
+    """Символы набора растеризуются один раз в одну текстуру, дальше берутся ее области"""
+    CHARSET = ' 0123456789.,:-+%/msKMGBhd'
     
-    def load_config(self):
-        """Загружает конфигурацию из файла"""
-        if os.path.exists(self.filepath):
-            try:
-                with open(self.filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
-    
-    def save_config(self, config_string):
-        """Сохраняет конфигурацию в файл"""
-        try:
-            self.config = {
-                'config': config_string,
-                'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            with open(self.filepath, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=4)
-            return True
-        except:
-            return False
+    def __init__(self, font_size, color, bold=False, charset=CHARSET):
+        label = CoreLabel(text=charset, font_size=font_size, color=tuple(color), bold=bold)
+        label.refresh()
+        self.texture = label.texture
+        self.height = self.texture.height
+        self.glyphs = {}
+        x = 0
+        for i, char in enumerate(charset):
+            right = label.get_extents(charset[:i + 1])[0]
+            self.glyphs[char] = self.texture.get_region(x, 0, right - x, self.height)
+            x = right
+    
+    def glyph(self, char):
+        return self.glyphs.get(char)
+
+
+_glyph_atlases = OrderedDict()
+
+
+def glyph_atlas(font_size, color, bold=False):
+    key = (round(font_size, 2), tuple(color), bold)
+    atlas = _glyph_atlases.get(key)
+    if atlas is None:
+        atlas = _glyph_atlases[key] = GlyphAtlas(font_size, color, bold)
+        while len(_glyph_atlases) > 8:
+            _glyph_atlases.popitem(last=False)
+    return atlas
+
+
+class CachedLabel(Widget):
+    """Замена Label для часто меняющегося текста: смена text - это смена текстуры из кэша,
+    смена color - только смена цвета инструкции Color"""
+    text = StringProperty('')
+    color = ListProperty([1, 1, 1, 1])
+    font_size = NumericProperty('15sp')
+    bold = BooleanProperty(False)
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        with self.canvas:
+            self.tint = Color(*self.color)
+            self.rect = Rectangle(pos=self.pos, size=(0, 0))
+        self.bind(text=self.update_texture, font_size=self.update_texture, bold=self.update_texture)
+        self.bind(color=self.update_color)
+        self.bind(pos=self.update_graphics, size=self.update_graphics)
+        self.update_texture()
+    
+    def update_color(self, *args):
+        self.tint.rgba = self.color
+    
+    def update_texture(self, *args):
+        if self.text:
+            self.rect.texture = label_textures.get(self.text, self.font_size, self.bold)
+        else:
+            self.rect.texture = None
+        self.update_graphics()
+    
+    def update_graphics(self, *args):
+        texture = self.rect.texture
+        if texture is None:
+            self.rect.size = (0, 0)
+            return
+        self.rect.size = texture.size
+        self.rect.pos = (int(self.center_x - texture.width / 2), int(self.center_y - texture.height / 2))
+
+
+class NumericReadout(Widget):
+    """Числовые показатели из атласа глифов: обновление без растеризации текста"""
+    text = StringProperty('')
+    color = ListProperty([1, 1, 1, 1])
+    font_size = NumericProperty('12sp')
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.rects = []
+        self.bind(text=self.update_graphics, color=self.update_graphics, font_size=self.update_graphics)
+        self.bind(pos=self.update_graphics, size=self.update_graphics)
+    
+    def update_graphics(self, *args):
+        atlas = glyph_atlas(self.font_size, self.color)
+        glyphs = [atlas.glyph(char) for char in self.text if atlas.glyph(char) is not None]
+        while len(self.rects) < len(glyphs):
+            with self.canvas:
+                Color(1, 1, 1, 1)
+                self.rects.append(Rectangle(size=(0, 0)))
+        x = int(self.center_x - sum(g.width for g in glyphs) / 2)
+        y = int(self.center_y - atlas.height / 2)
+        for i, rect in enumerate(self.rects):
+            if i < len(glyphs):
+                rect.texture = glyphs[i]
+                rect.size = glyphs[i].size
+                rect.pos = (x, y)
+                x += glyphs[i].width
+            else:
+                rect.size = (0, 0)
+
+
+def prewarm_label_textures():
+    """Растеризует фиксированные строки статуса заранее, до первого переключения"""
+    entries = [(text, sp(24), True) for text in ('ON', 'OFF')]
+    entries += [(text, sp(14), True) for text in ('CONNECTED', 'DISCONNECTED')]
+    entries += [(text, sp(12), False) for text in ('IP: HIDDEN', 'IP: 192.168.1.1')]
+    entries += [(f'LOCATION: {region}', sp(12), False) for region, _ in REGIONS]
+    label_textures.prewarm(entries)
+    glyph_atlas(sp(11), (0.5,0.5,0.5,1))
+
+
+class ClockSchedulerDriver:
+    """Привязывает TaskScheduler к Kivy Clock: одно событие на ближайший срок"""
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._event = None
+        self._reschedule_trigger = Clock.create_trigger(self.reschedule)
+        scheduler.add_listener(self._reschedule_trigger)
+        self.reschedule()
     
-    def has_config(self):
-        """Проверяет, есть ли сохраненная конфигурация"""
-        return 'config' in self.config and self.config['config']
+    def reschedule(self, *args):
+        if self._event:
+            self._event.cancel()
+        self._event = Clock.schedule_once(self._tick, self.scheduler.next_wakeup())
     
-    def get_config(self):
-        """Получает сохраненную конфигурацию"""
-        return self.config.get('config', '')
+    def _tick(self, dt):
+        self.scheduler.run_due()
+        self.reschedule()
 
 
 class DeadInput(FloatLayout):
@@ -156,6 +305,15 @@ class VideoBackground(FloatLayout):
             self.rect = Rectangle(pos=self.pos, size=self.size)
         self.bind(size=self._update_rect, pos=self._update_rect)
     
+    def pause(self):
+        """Останавливает видео, пока приложение в фоне"""
+        if hasattr(self, 'video'):
+            self.video.state = 'pause'
+    
+    def resume(self):
+        if hasattr(self, 'video'):
+            self.video.state = 'play'
+    
     def on_video_state(self, instance, value):
         """Перезапускает видео при завершении"""
         if value == 'stop':
@@ -189,7 +347,7 @@ class DeadVPNButton(FloatLayout):
             self.outer_ring = Ellipse(pos=(0,0), size=(0,0))
             self.inner_color = Color(0,0,0,0.8)
             self.inner_circle = Ellipse(pos=(0,0), size=(0,0))
-        self.status_text = Label(text='OFF', font_size='24sp', color=(0.5,0.5,0.5,1), pos_hint={'center_x':0.5,'center_y':0.5}, bold=True)
+        self.status_text = CachedLabel(text='OFF', font_size='24sp', color=(0.5,0.5,0.5,1), pos_hint={'center_x':0.5,'center_y':0.5}, bold=True)
         self.add_widget(self.status_text)
         self.bind(size=self.update_graphics, pos=self.update_graphics, scale=self.update_graphics)
     
@@ -233,10 +391,11 @@ class DeadVPNButton(FloatLayout):
 
 class RegionButton(BoxLayout):
     """Кнопка региона"""
-    def __init__(self, country_name, flag_url, callback=None, **kwargs):
+    def __init__(self, country_name, flag_url, callback=None, favourite_callback=None, **kwargs):
         super().__init__(**kwargs)
         self.country_name = country_name
         self.callback = callback
+        self.favourite_callback = favourite_callback
         self.selected = False
         self.orientation = 'horizontal'
         self.size_hint_y = None
@@ -257,6 +416,9 @@ class RegionButton(BoxLayout):
         self.add_widget(self.country_label)
         self.selection_indicator = Label(text='', font_size='18sp', size_hint_x=0.1, color=(0.8,0.8,0.8,1))
         self.add_widget(self.selection_indicator)
+        self.health_label = Label(text='', font_size='11sp', size_hint_x=0.25, color=(0.8,0.3,0.3,1))
+        self.add_widget(self.health_label)
+        self.entry = None
         self.bind(size=self.update_graphics, pos=self.update_graphics)
     
     def _update_text_size(self, instance, value):
@@ -279,16 +441,41 @@ class RegionButton(BoxLayout):
             self.country_label.color = (0.7,0.7,0.7,1)
             self.selection_indicator.text = ''
     
+    def set_health(self, healthy, pinned=False):
+        """Помечает регион недоступным; None - данных пока нет"""
+        if healthy is False:
+            self.health_label.color = (0.8,0.3,0.3,1)
+            self.health_label.text = 'OFFLINE'
+        else:
+            self.health_label.color = (0.6,0.6,0.6,1)
+            self.health_label.text = 'PINNED' if pinned else ''
+        self.flag_image.opacity = 0.4 if healthy is False else 1
+    
+    def set_entry(self, entry):
+        """Показывает запись каталога (кнопки переиспользуются при поиске)"""
+        self.entry = entry
+        self.country_name = entry.country or entry.title
+        self.country_label.text = entry.title if entry.kind == REGION else f'{entry.title}  [{entry.protocol.upper()}]'
+        self.country_label.font_size = '16sp' if entry.kind == REGION else '13sp'
+        source = flag_path(entry.flag) if entry.flag else ''
+        if self.flag_image.source != source:
+            self.flag_image.source = source if os.path.exists(source) else ''
+    
     def on_touch_down(self, touch):
         if self.collide_point(*touch.pos):
-            if self.callback:
+            if touch.is_double_tap and self.entry is not None and self.favourite_callback:
+                # Двойное касание закрепляет запись наверху списка
+                self.favourite_callback(self)
+            elif self.callback:
                 self.callback(self)
             return True
         return super().on_touch_down(touch)
 
 
 class RegionSelectionPopup(Popup):
-    """Попап выбора региона"""
+    """Попап выбора региона или сервера с поиском по каталогу"""
+    RESULT_LIMIT = 50
+    
     def __init__(self, main_app, **kwargs):
         super().__init__(**kwargs)
         self.main_app = main_app
@@ -300,49 +487,69 @@ class RegionSelectionPopup(Popup):
         self.title_color = (0.8,0.8,0.8,1)
         self.separator_color = (0.3,0.3,0.3,1)
         content = FloatLayout()
-        scroll = ScrollView(size_hint=(0.9,0.7), pos_hint={'center_x':0.5,'center_y':0.55}, do_scroll_x=False)
-        regions_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=8, padding=[10,10])
-        regions_layout.bind(minimum_height=regions_layout.setter('height'))
-        
-        # Получаем правильные пути к флагам
-        data_dir = get_data_dir()
-        countries = [
-            ('USA', os.path.join(data_dir, 'flags', 's1.png')),
-            ('UNITED KINGDOM', os.path.join(data_dir, 'flags', 's5.png')),
-            ('GERMANY', os.path.join(data_dir, 'flags', 's6.png')),
-            ('JAPAN', os.path.join(data_dir, 'flags', 's4.png')),
-            ('CANADA', os.path.join(data_dir, 'flags', 's3.png')),
-            ('FRANCE', os.path.join(data_dir, 'flags', 's2.png'))
-        ]
+        self.search_input = TextInput(hint_text='SEARCH', multiline=False, size_hint=(0.9,None), height=40, pos_hint={'center_x':0.5,'top':0.98}, background_color=(0.1,0.1,0.1,1), foreground_color=(0.9,0.9,0.9,1), cursor_color=(0.8,0.8,0.8,1), font_size='14sp')
+        # Поиск запускается после паузы в наборе, а не на каждую букву
+        self._search_trigger = Clock.create_trigger(self.apply_search, 0.12)
+        self.search_input.bind(text=lambda instance, value: self._search_trigger())
+        content.add_widget(self.search_input)
+        scroll = ScrollView(size_hint=(0.9,0.66), pos_hint={'center_x':0.5,'center_y':0.52}, do_scroll_x=False)
+        self.regions_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=8, padding=[10,10])
+        self.regions_layout.bind(minimum_height=self.regions_layout.setter('height'))
         
         self.region_buttons = []
-        for country, flag_path in countries:
-            btn = RegionButton(country, flag_path, callback=self.on_region_select, size_hint_y=None, height=60)
-            regions_layout.add_widget(btn)
-            self.region_buttons.append(btn)
-        self.set_current_region_selected()
-        scroll.add_widget(regions_layout)
+        preferred = self.main_app.connection.preferred
+        self.selected_key = server_key(preferred) if preferred else self.main_app.current_region
+        self._shown_keys = None
+        self.apply_search()
+        scroll.add_widget(self.regions_layout)
         content.add_widget(scroll)
         confirm_btn = DeadButton(text='CONFIRM SELECTION', callback=self.confirm_selection, size_hint=(0.8,None), height=50, pos_hint={'center_x':0.5,'y':0.05}, font_size='16sp')
         content.add_widget(confirm_btn)
         self.content = content
     
-    def set_current_region_selected(self):
-        for btn in self.region_buttons:
-            if btn.country_name == self.main_app.current_region:
-                btn.set_selected(True)
-                self.selected_region = btn
-                break
+    def apply_search(self, *args):
+        """Показывает результаты поиска, переиспользуя кнопки"""
+        catalog = self.main_app.catalog
+        entries = catalog.search(self.search_input.text, limit=self.RESULT_LIMIT)
+        keys = [entry.key for entry in entries]
+        if keys != self._shown_keys:
+            self._shown_keys = keys
+            while len(self.region_buttons) < len(entries):
+                self.region_buttons.append(RegionButton('', '', callback=self.on_region_select, favourite_callback=self.toggle_favourite, size_hint_y=None, height=60))
+            self.regions_layout.clear_widgets()
+            self.selected_region = None
+            for btn, entry in zip(self.region_buttons, entries):
+                btn.set_entry(entry)
+                self.regions_layout.add_widget(btn)
+                btn.set_selected(entry.key == self.selected_key)
+                if entry.key == self.selected_key:
+                    self.selected_region = btn
+        self.update_health()
+    
+    def update_health(self):
+        catalog = self.main_app.catalog
+        for btn, key in zip(self.region_buttons, self._shown_keys):
+            btn.set_health(catalog.health.get(key), pinned=key in catalog.favourites)
+    
+    def toggle_favourite(self, region_btn):
+        self.main_app.catalog.toggle_favourite(region_btn.entry.key)
+        self._shown_keys = None
+        self.apply_search()
+        self.main_app.save_session()
     
     def on_region_select(self, region_btn):
         for btn in self.region_buttons:
             btn.set_selected(False)
         region_btn.set_selected(True)
         self.selected_region = region_btn
+        self.selected_key = region_btn.entry.key
     
     def confirm_selection(self, instance):
         if self.selected_region:
-            self.main_app.current_region = self.selected_region.country_name
+            entry = self.selected_region.entry
+            self.main_app.catalog.add_recent(entry.key)
+            self.main_app.current_region = entry.country or self.main_app.current_region
+            self.main_app.connection.set_region(self.main_app.current_region, entry.endpoint)
             self.main_app.dead_status.update_dead_status(self.main_app.dead_button.is_connected, self.main_app.current_region)
         self.dismiss()
 
@@ -431,13 +638,15 @@ class DeadStatusPanel(FloatLayout):
             self.border = RoundedRectangle(pos=self.pos, size=self.size, radius=[6])
             self.bg_color = Color(0,0,0,0.8)
             self.bg = RoundedRectangle(pos=self.pos, size=self.size, radius=[6])
-        info_layout = BoxLayout(orientation='vertical', size_hint=(0.9,0.8), pos_hint={'center_x':0.5,'center_y':0.5}, spacing=8)
-        self.status_label = Label(text='DISCONNECTED', font_size='14sp', color=(0.4,0.4,0.4,1), bold=True)
-        self.ip_label = Label(text='IP: HIDDEN', font_size='12sp', color=(0.3,0.3,0.3,1))
-        self.location_label = Label(text='LOCATION: USA', font_size='12sp', color=(0.3,0.3,0.3,1))
+        info_layout = BoxLayout(orientation='vertical', size_hint=(0.9,0.8), pos_hint={'center_x':0.5,'center_y':0.5}, spacing=4)
+        self.status_label = CachedLabel(text='DISCONNECTED', font_size='14sp', color=(0.4,0.4,0.4,1), bold=True)
+        self.ip_label = CachedLabel(text='IP: HIDDEN', font_size='12sp', color=(0.3,0.3,0.3,1))
+        self.location_label = CachedLabel(text='LOCATION: USA', font_size='12sp', color=(0.3,0.3,0.3,1))
+        self.stats_readout = NumericReadout(text='', font_size='11sp', color=(0.5,0.5,0.5,1))
         info_layout.add_widget(self.status_label)
         info_layout.add_widget(self.ip_label)
         info_layout.add_widget(self.location_label)
+        info_layout.add_widget(self.stats_readout)
         self.add_widget(info_layout)
         self.bind(size=self.update_graphics, pos=self.update_graphics)
     
@@ -462,6 +671,13 @@ class DeadStatusPanel(FloatLayout):
             self.ip_label.color = (0.3,0.3,0.3,1)
             self.location_label.text = f'LOCATION: {region}'
             self.location_label.color = (0.3,0.3,0.3,1)
+            self.stats_readout.text = ''
+    
+    def update_readout(self, latency_ms, uptime):
+        """Живые показатели: задержка и время подключения"""
+        hours, rest = divmod(int(uptime), 3600)
+        latency = f'{latency_ms:.0f} ms  ' if latency_ms is not None else ''
+        self.stats_readout.text = f'{latency}{hours:02d}:{rest // 60:02d}:{rest % 60:02d}'
 
 
 class ConfigInputScreen(FloatLayout):
@@ -541,10 +757,10 @@ class ConfigInputScreen(FloatLayout):
             self.error_label.text = 'Пожалуйста, введите конфигурацию'
             return
         
-        if len(config) < 10:
-            self.error_label.text = 'Конфигурация слишком короткая'
-            return
-        
+        self.main_app.validate_config(config, self.error_label, self.save_validated)
+    
+    def save_validated(self, config):
+        """Сохраняет конфигурацию, прошедшую проверку"""
         if self.main_app.config_db.save_config(config):
             self.error_label.color = (0.3, 1, 0.3, 1)
             self.error_label.text = 'Конфигурация сохранена!'
@@ -561,7 +777,7 @@ class HamburgerMenu(DropDown):
         self.main_app = main_app
         self.auto_width = False
         self.width = 240
-        self.max_height = 180
+        self.max_height = 240
         self.background_color = (0.05,0.05,0.05,0.95)
         self.border = [10,10,10,10]
         self.create_menu_buttons()
@@ -576,6 +792,24 @@ class HamburgerMenu(DropDown):
         )
         self.add_widget(add_config_btn)
         
+        traffic_btn = DeadButton(
+            text='Трафик приложений',
+            callback=self.open_traffic,
+            size_hint_y=None,
+            height=55,
+            font_size='15sp'
+        )
+        self.add_widget(traffic_btn)
+        
+        self.reconnect_btn = DeadButton(
+            text=self.reconnect_text(),
+            callback=self.toggle_auto_reconnect,
+            size_hint_y=None,
+            height=55,
+            font_size='15sp'
+        )
+        self.add_widget(self.reconnect_btn)
+        
         support_btn = DeadButton(
             text='Support',
             callback=self.open_support,
@@ -589,9 +823,22 @@ class HamburgerMenu(DropDown):
         self.dismiss()
         self.main_app.open_add_config_popup()
     
+    def open_traffic(self, instance):
+        self.dismiss()
+        self.main_app.open_traffic_popup()
+    
     def open_support(self, instance):
         self.dismiss()
         self.main_app.open_support_popup()
+    
+    def reconnect_text(self):
+        state = 'вкл' if self.main_app.auto_reconnect else 'выкл'
+        return f'Автоподключение: {state}'
+    
+    def toggle_auto_reconnect(self, instance):
+        """Переключает восстановление подключения при следующем запуске"""
+        self.main_app.set_auto_reconnect(not self.main_app.auto_reconnect)
+        instance.text_label.text = self.reconnect_text()
 
 
 class HamburgerIcon(Button):
@@ -727,10 +974,10 @@ class AddConfigPopup(Popup):
             self.error_label.text = 'Введите конфигурацию VPN для подключения'
             return
         
-        if len(config) < 10:
-            self.error_label.text = 'Конфигурация слишком короткая'
-            return
-        
+        self.main_app.validate_config(config, self.error_label, self.save_validated)
+    
+    def save_validated(self, config):
+        """Сохраняет конфигурацию, прошедшую проверку"""
         if self.main_app.config_db.save_config(config):
             self.error_label.color = (0.3, 1, 0.3, 1)
             self.error_label.text = 'Конфигурация обновлена!'
@@ -740,6 +987,55 @@ class AddConfigPopup(Popup):
             self.error_label.text = 'Ошибка сохранения'
 
 
+class TrafficPopup(Popup):
+    """Попап с трафиком по приложениям"""
+    def __init__(self, main_app, **kwargs):
+        super().__init__(**kwargs)
+        self.main_app = main_app
+        self.title = 'ТРАФИК ПРИЛОЖЕНИЙ'
+        self.size_hint = (0.9, 0.7)
+        self.auto_dismiss = True
+        self.background_color = (0, 0, 0, 0.95)
+        self.title_color = (0.8, 0.8, 0.8, 1)
+        self.separator_color = (0.3, 0.3, 0.3, 1)
+        
+        content = FloatLayout()
+        
+        scroll = ScrollView(size_hint=(0.9, 0.7), pos_hint={'center_x': 0.5, 'center_y': 0.58}, do_scroll_x=False)
+        self.rows_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=6, padding=[10, 10])
+        self.rows_layout.bind(minimum_height=self.rows_layout.setter('height'))
+        scroll.add_widget(self.rows_layout)
+        content.add_widget(scroll)
+        
+        close_btn = DeadButton(
+            text='ЗАКРЫТЬ',
+            callback=lambda x: self.dismiss(),
+            size_hint=(0.7, None),
+            height=50,
+            pos_hint={'center_x': 0.5, 'y': 0.05},
+            font_size='16sp'
+        )
+        content.add_widget(close_btn)
+        self.content = content
+        self.refresh()
+    
+    def refresh(self):
+        """Перерисовывает список по текущим итогам учета"""
+        self.rows_layout.clear_widgets()
+        rows = self.main_app.traffic_accounting.breakdown()
+        if not rows:
+            self.rows_layout.add_widget(Label(text='Пока нет трафика', font_size='13sp', color=(0.5, 0.5, 0.5, 1), size_hint_y=None, height=30))
+            return
+        for row in rows:
+            line = BoxLayout(orientation='horizontal', size_hint_y=None, height=30)
+            name_label = Label(text=row['owner'], font_size='13sp', color=(0.8, 0.8, 0.8, 1), halign='left', valign='middle', size_hint_x=0.55, shorten=True)
+            name_label.bind(size=lambda instance, value: setattr(instance, 'text_size', value))
+            line.add_widget(name_label)
+            total = f"↑ {format_bytes(row['bytes_up'])}  ↓ {format_bytes(row['bytes_down'])}"
+            line.add_widget(Label(text=total, font_size='12sp', color=(0.6, 0.6, 0.6, 1), size_hint_x=0.45))
+            self.rows_layout.add_widget(line)
+
+
 class SupportPopup(Popup):
     """Попап поддержки"""
     def __init__(self, main_app, **kwargs):
@@ -838,8 +1134,35 @@ class SupportPopup(Popup):
 class VPNApp(App):
     """Основное приложение VPN"""
     def build(self):
-        self.current_region = 'USA'
+        self.current_region = DEFAULT_REGION
         self.config_db = ConfigDatabase(CONFIG_FILE)
+        self.health_monitor = HealthMonitor()
+        self.traffic_accounting = TrafficAccounting()
+        self.connection = ConnectionManager(self.config_db, self.current_region, health=self.health_monitor,
+                                            accounting=self.traffic_accounting, relay_port=DEFAULT_RELAY_PORT)
+        self._health_trigger = Clock.create_trigger(self._on_health_changed)
+        self.health_monitor.add_listener(lambda health: self._health_trigger())
+        self.scheduler = TaskScheduler()
+        self.scheduler.register('health', self._health_tick, 1.0, NORMAL, run_now=True)
+        self.scheduler.register('power', self._power_tick, 60.0, IDLE, run_now=True)
+        self.scheduler.register('frame_watch', self._frame_watch_tick, 2.0, UI)
+        self.scheduler.register('status_ticker', self._status_tick, 1.0, UI)
+        self.scheduler.register('traffic_flush', self.traffic_accounting.flush, 1.0, IDLE)
+        self.scheduler_driver = ClockSchedulerDriver(self.scheduler)
+        self.validator = ConfigValidator()
+        # Сначала только регионы; серверы добавляются после разбора конфигурации в фоне
+        self.catalog = ServerCatalog(build_entries())
+        self._catalog_source = None
+        self.session_store = SessionStore(SESSION_FILE, vault=self.config_db.vault)
+        # Переподключаться ли при запуске к прошлому серверу; хранится в сессии
+        self.auto_reconnect = True
+        self._restoring = True
+        self.connection.add_listener(lambda manager: self.save_session())
+        # Прошлая сессия восстанавливается параллельно с построением UI
+        threading.Thread(target=self._restore_session, daemon=True).start()
+        self._validation_token = None
+        # Конфигурация, серверы которой не ответили: повторное нажатие сохраняет ее без проверки
+        self._unverified_config = None
         self.region_popup = None
         self.hamburger_menu = None
         
@@ -852,6 +1175,7 @@ class VPNApp(App):
         else:
             self.show_main_interface()
         
+        Clock.schedule_once(lambda dt: prewarm_label_textures(), 0)
         return self.root
     
     def show_config_input(self):
@@ -923,11 +1247,213 @@ class VPNApp(App):
     def toggle_dead_vpn(self, instance):
         """Переключает состояние VPN"""
         self.dead_status.update_dead_status(self.dead_button.is_connected, self.current_region)
+        if self.dead_button.is_connected:
+            threading.Thread(target=self._connect_worker, args=(self.current_region,), daemon=True).start()
+        else:
+            self.connection.disconnect()
+    
+    def _connect_worker(self, region):
+        """Подключение в фоне, чтобы проверка серверов не блокировала UI"""
+        try:
+            self.connection.connect(region)
+        except VPNError:
+            Clock.schedule_once(lambda dt: self.on_connect_failed(), 0)
+    
+    def on_connect_failed(self):
+        """Возвращает кнопку в OFF, если подключиться не удалось"""
+        self.dead_button.is_connected = False
+        self.dead_button.update_dead_state()
+        self.dead_status.update_dead_status(False, self.current_region)
+    
+    def validate_config(self, config, error_label, on_valid):
+        """Проверяет конфигурацию в фоне, выводя ход проверки в error_label.
+
+        Ошибка разбора не дает сохранить конфигурацию. Недоступность серверов -
+        только предупреждение: повторное сохранение той же конфигурации проходит.
+        """
+        if config == self._unverified_config:
+            self._unverified_config = None
+            self._validation_token = None
+            on_valid(config)
+            return
+        self._unverified_config = None
+        token = self._validation_token = object()
+        error_label.color = (0.6, 0.6, 0.6, 1)
+        error_label.text = 'Проверка конфигурации...'
+        
+        def on_event(event):
+            Clock.schedule_once(lambda dt: self._show_validation_event(token, event, config, error_label, on_valid), 0)
+        
+        self.validator.validate_async(config, on_event)
+    
+    def _show_validation_event(self, token, event, config, error_label, on_valid):
+        """Показывает очередной результат проверки (вызывается в UI-потоке)"""
+        if token is not self._validation_token:
+            return
+        if event.kind == 'parsed':
+            error_label.text = f'Серверов: {len(event.data.endpoints)}, проверка...'
+        elif event.kind == 'probe':
+            result = event.data
+            server = f'{result.endpoint.host}:{result.endpoint.port}'
+            if result.ok:
+                latency = f' {result.latency * 1000:.0f} мс' if result.latency is not None else ''
+                error_label.text = f'{server} доступен{latency}'
+            else:
+                error_label.text = f'{server}: {result.error}'
+        elif event.data.ok:
+            self._validation_token = None
+            on_valid(config)
+        elif event.data.saveable:
+            self._validation_token = None
+            self._unverified_config = config
+            error_label.color = (1, 0.7, 0.2, 1)
+            error_label.text = f'{event.data.summary()}. Нажмите еще раз, чтобы сохранить'
+        else:
+            self._validation_token = None
+            error_label.color = (1, 0.3, 0.3, 1)
+            error_label.text = event.data.summary()
+    
+    def _restore_session(self):
+        """Загружает прошлую сессию и при необходимости переподключается (фоновый поток)"""
+        state = self.session_store.load()
+        self.auto_reconnect = state.get('auto_reconnect', True)
+        self.catalog.restore_pins(state.get('pins'))
+        self.refresh_catalog()
+        if state.get('region'):
+            Clock.schedule_once(lambda dt: self._apply_session_region(state['region']), 0)
+        reconnected = restore_session(self.connection, state) if state else False
+        self._restoring = False
+        if reconnected:
+            Clock.schedule_once(lambda dt: self._on_session_restored(), 0)
+        self.save_session()
+    
+    def _apply_session_region(self, region):
+        self.current_region = region
+        if hasattr(self, 'dead_status'):
+            self.dead_status.update_dead_status(self.connection.connected, region)
+    
+    def _on_session_restored(self):
+        """Показывает восстановленное подключение"""
+        if not hasattr(self, 'dead_button') or not self.connection.connected:
+            return
+        self.dead_button.is_connected = True
+        self.dead_button.update_dead_state()
+        self.dead_status.update_dead_status(True, self.current_region)
+    
+    def save_session(self):
+        if not self._restoring:
+            self.session_store.save(capture_session(self.connection, self.auto_reconnect, catalog=self.catalog))
+    
+    def set_auto_reconnect(self, enabled):
+        self.auto_reconnect = enabled
+        self.save_session()
+    
+    def on_stop(self):
+        self.save_session()
+    
+    def on_pause(self):
+        """Приложение уходит в фон: останавливаем видео и некритичные задачи"""
+        self.save_session()
+        self.scheduler.set_state(paused=True)
+        self.video_bg.pause()
+        return True
+    
+    def on_resume(self):
+        self.scheduler.set_state(paused=False, battery_saver=is_battery_saver())
+        self.video_bg.resume()
+    
+    def _power_tick(self):
+        self.scheduler.set_state(battery_saver=is_battery_saver())
+    
+    def _frame_watch_tick(self):
+        """Замедляет фоновую работу, если UI не укладывается в бюджет кадра"""
+        fps = Clock.get_fps()
+        self.scheduler.set_state(overloaded=0 < fps < MIN_FPS)
+    
+    def _status_tick(self):
+        """Обновляет живые показатели на панели статуса"""
+        if not hasattr(self, 'dead_status') or not self.connection.connected:
+            return
+        health = self.health_monitor.get(self.connection.endpoint)
+        latency = health.latency if health and health.latency is not None else self.connection.latency
+        uptime = self.connection.status()['uptime']
+        self.dead_status.update_readout(latency * 1000 if latency is not None else None, uptime)
+    
+    def _health_tick(self):
+        """Передает монитору актуальные серверы и запускает назревшие проверки"""
+        try:
+            endpoints = self.connection.endpoints(block=False)
+        except ValueError:
+            return None
+        if endpoints is None:
+            # Конфигурация еще расшифровывается в фоне
+            return 1.0
+        self.health_monitor.set_endpoints(endpoints)
+        if self.connection.connected and self.connection.endpoint:
+            priority = [self.connection.endpoint]
+        else:
+            priority = endpoints_for_region(endpoints, self.current_region) or endpoints
+        # Избранное проверяется часто, чтобы в списке регионов его состояние было свежим
+        self.health_monitor.set_priority(priority + self.catalog.favourite_endpoints())
+        self.health_monitor.run_due()
+        return min(max(self.health_monitor.next_due(), 1.0), 30.0)
+    
+    def _on_health_changed(self, dt):
+        if self.region_popup and self.region_popup.parent:
+            self.update_catalog_health()
+            self.region_popup.update_health()
+    
+    def refresh_catalog(self):
+        """Перестраивает каталог, если конфигурация изменилась (вызывать вне UI-потока)"""
+        raw = self.config_db.get_config()
+        if raw == self._catalog_source:
+            return False
+        try:
+            endpoints = self.connection.endpoints()
+        except ValueError:
+            endpoints = []
+        self.catalog.set_entries(build_entries(endpoints))
+        self._catalog_source = raw
+        return True
+    
+    def _refresh_catalog_worker(self, popup):
+        if self.refresh_catalog():
+            Clock.schedule_once(lambda dt: self._on_catalog_refreshed(popup), 0)
+    
+    def _on_catalog_refreshed(self, popup):
+        self.update_catalog_health()
+        popup.apply_search()
+    
+    def update_catalog_health(self):
+        """Переносит данные мониторинга в индекс доступности каталога"""
+        health = {}
+        for entry in self.catalog.entries:
+            if entry.kind == REGION:
+                health[entry.key] = self.region_health(entry.key)
+            else:
+                server = self.health_monitor.get(entry.endpoint)
+                health[entry.key] = server.healthy if server is not None and server.known else None
+        self.catalog.set_health(health)
+    
+    def region_health(self, region):
+        """True/False по данным мониторинга или None, если серверов региона нет"""
+        try:
+            endpoints = self.connection.endpoints(block=False)
+        except ValueError:
+            return None
+        if endpoints is None:
+            return None
+        return self.health_monitor.region_health(endpoints_for_region(endpoints, region))
     
     def open_region_popup(self, instance):
         """Открывает попап выбора региона"""
+        self.update_catalog_health()
         self.region_popup = RegionSelectionPopup(self)
         self.region_popup.open()
+        # Без блокировки: если ключ еще не готов, воркер дождется его сам
+        raw = self.config_db.get_config(block=False)
+        if raw is None or raw != self._catalog_source:
+            threading.Thread(target=self._refresh_catalog_worker, args=(self.region_popup,), daemon=True).start()
     
     def open_hamburger_menu(self, instance):
         """Открывает меню гамбургера"""
@@ -940,6 +1466,13 @@ class VPNApp(App):
         add_config_popup = AddConfigPopup(self)
         add_config_popup.open()
     
+    def open_traffic_popup(self):
+        """Открывает попап трафика и обновляет его, пока он открыт"""
+        traffic_popup = TrafficPopup(self)
+        self.scheduler.register('traffic_view', traffic_popup.refresh, 2.0, UI)
+        traffic_popup.bind(on_dismiss=lambda *args: self.scheduler.unregister('traffic_view'))
+        traffic_popup.open()
+    
     def open_support_popup(self):
         """Открывает попап поддержки"""
         support_popup = SupportPopup(self)
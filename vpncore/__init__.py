@@ -0,0 +1,11 @@
+"""Ядро IKISKY VPN без Kivy: конфигурация, разбор, проверка серверов, подключение"""
+from .accounting import TrafficAccounting
+from .catalog import ServerCatalog
+from .config import ConfigDatabase, ConfigError, Endpoint, ParsedConfig, parse_config
+from .connection import ConnectionManager, VPNError
+from .health import HealthMonitor, TokenBucket
+from .paths import CONFIG_FILE, SESSION_FILE, get_data_dir, platform
+from .probe import ProbeResult, probe_endpoint, probe_many
+from .regions import DEFAULT_REGION, REGIONS, endpoints_for_region, flag_path
+from .scheduler import TaskScheduler
+from .validation import ConfigValidator, ValidationReport
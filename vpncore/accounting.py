@@ -0,0 +1,424 @@
+"""Учет трафика по приложениям: счетчики в преаллоцированных массивах по номеру потока"""
+import os
+import socket
+import struct
+import threading
+import time
+from array import array
+
+from .paths import platform
+
+UNKNOWN = 'unknown'
+
+
+class AccountingFull(Exception):
+    """Закончились свободные номера потоков"""
+
+
+class TrafficAccounting:
+    """Счетчики байт по потокам, периодически сводимые в итоги по владельцам.
+
+    Горячий путь ретранслятора только увеличивает up[flow_id] / down[flow_id];
+    разбор владельцев и агрегация происходят в flush() пачкой. flush() в
+    счетчики не пишет, а запоминает уже учтенное значение (flushed_*), поэтому
+    прибавления из потока ретранслятора без блокировки не теряются.
+
+    Владельцы ищутся в одном фоновом потоке пачками: все потоки, открытые
+    за время предыдущего поиска, разбираются одним запросом sock_diag (без
+    него - одним чтением /proc), пока сокеты клиентов еще открыты. Слот с
+    незавершенным поиском после закрытия не освобождается: итоги
+    записываются, когда set_owner узнает владельца. Номер поколения слота не
+    дает запоздалому ответу приписать владельца новому потоку.
+    """
+    def __init__(self, max_flows=4096, resolver=None):
+        self.max_flows = max_flows
+        self.up = array('Q', bytes(8 * max_flows))
+        self.down = array('Q', bytes(8 * max_flows))
+        self.flushed_up = array('Q', bytes(8 * max_flows))
+        self.flushed_down = array('Q', bytes(8 * max_flows))
+        self.flow_owner = array('l', [-1] * max_flows)
+        self.generation = array('L', [0]) * max_flows
+        self.active = bytearray(max_flows)
+        self.pending = bytearray(max_flows)
+        self._free = list(range(max_flows - 1, -1, -1))
+        self.owner_index = {}
+        self.owner_names = []
+        self.owner_up = array('Q')
+        self.owner_down = array('Q')
+        self.owner_flows = array('Q')
+        self.resolver = resolver or OwnerResolver()
+        self._lock = threading.Lock()
+        self._lookups = []
+        self._lookup_running = False
+
+    def open_flow(self, peer=None, local=None):
+        """Выдает номер потока.
+
+        peer - адрес клиента: владелец ищется в фоне, пока сокет клиента еще
+        открыт; без peer владелец назначается вызовом set_owner.
+        """
+        with self._lock:
+            if not self._free:
+                raise AccountingFull('Нет свободных слотов учета')
+            flow_id = self._free.pop()
+            self.generation[flow_id] = (self.generation[flow_id] + 1) & 0xFFFFFFFF
+            self.active[flow_id] = 1
+            self.pending[flow_id] = 1 if peer is not None else 0
+            self.flow_owner[flow_id] = -1
+            if peer is None:
+                return flow_id
+            self._lookups.append((flow_id, self.generation[flow_id], peer, local))
+            if self._lookup_running:
+                return flow_id
+            self._lookup_running = True
+        threading.Thread(target=self._lookup_worker, daemon=True).start()
+        return flow_id
+
+    def _lookup_worker(self):
+        """Разбирает накопившиеся запросы пачками; завершается, когда очередь пуста"""
+        while True:
+            with self._lock:
+                batch, self._lookups = self._lookups, []
+                if not batch:
+                    self._lookup_running = False
+                    return
+            names = self.resolver.resolve_many([(peer, local) for _, _, peer, local in batch])
+            for (flow_id, generation, _, _), name in zip(batch, names):
+                self.set_owner(flow_id, generation, name)
+
+    def lookups_pending(self):
+        with self._lock:
+            return self._lookup_running
+
+    def _owner(self, name):
+        index = self.owner_index.get(name)
+        if index is None:
+            index = self.owner_index[name] = len(self.owner_names)
+            self.owner_names.append(name)
+            self.owner_up.append(0)
+            self.owner_down.append(0)
+            self.owner_flows.append(0)
+        return index
+
+    def _assign(self, flow_id, name):
+        index = self._owner(name or UNKNOWN)
+        self.flow_owner[flow_id] = index
+        self.owner_flows[index] += 1
+
+    def set_owner(self, flow_id, generation, name):
+        with self._lock:
+            if self.generation[flow_id] != generation or self.flow_owner[flow_id] >= 0:
+                return
+            if not (self.active[flow_id] or self.pending[flow_id]):
+                return
+            self.pending[flow_id] = 0
+            self._assign(flow_id, name)
+            if not self.active[flow_id]:
+                # Поток уже закрыт и ждал только владельца
+                self._release(flow_id)
+
+    def _flush_flow(self, flow_id):
+        owner = self.flow_owner[flow_id]
+        if owner < 0:
+            return
+        # Каждый счетчик читается один раз: поток ретранслятора может прибавлять параллельно
+        up = self.up[flow_id]
+        down = self.down[flow_id]
+        self.owner_up[owner] += up - self.flushed_up[flow_id]
+        self.owner_down[owner] += down - self.flushed_down[flow_id]
+        self.flushed_up[flow_id] = up
+        self.flushed_down[flow_id] = down
+
+    def _release(self, flow_id):
+        if self.flow_owner[flow_id] < 0:
+            self._assign(flow_id, UNKNOWN)
+        self._flush_flow(flow_id)
+        self.up[flow_id] = self.down[flow_id] = 0
+        self.flushed_up[flow_id] = self.flushed_down[flow_id] = 0
+        self.flow_owner[flow_id] = -1
+        self.pending[flow_id] = 0
+        self._free.append(flow_id)
+
+    def close_flow(self, flow_id):
+        with self._lock:
+            self.active[flow_id] = 0
+            if self.pending[flow_id] and self.flow_owner[flow_id] < 0:
+                return
+            self._release(flow_id)
+
+    def flush(self):
+        """Переносит накопленные байты потоков с известным владельцем в итоги"""
+        with self._lock:
+            for flow_id in range(self.max_flows):
+                if self.flow_owner[flow_id] >= 0:
+                    self._flush_flow(flow_id)
+
+    def breakdown(self):
+        """Итоги по владельцам, самые активные первыми"""
+        self.flush()
+        with self._lock:
+            rows = [{
+                'owner': name,
+                'bytes_up': self.owner_up[i],
+                'bytes_down': self.owner_down[i],
+                'flows': self.owner_flows[i],
+            } for i, name in enumerate(self.owner_names)]
+        rows.sort(key=lambda row: row['bytes_up'] + row['bytes_down'], reverse=True)
+        return rows
+
+    def totals(self):
+        self.flush()
+        with self._lock:
+            return sum(self.owner_up), sum(self.owner_down)
+
+
+def _proc_keys(peer):
+    """Варианты записи адреса в /proc/net/tcp(6): hex в порядке байт ядра"""
+    ip, port = peer[0], peer[1]
+    port = f'{port:04X}'
+    if ':' in ip:
+        raw = socket.inet_pton(socket.AF_INET6, ip)
+        return [struct.pack('<4I', *struct.unpack('>4I', raw)).hex().upper() + ':' + port]
+    raw = socket.inet_aton(ip)
+    mapped = socket.inet_pton(socket.AF_INET6, '::ffff:' + ip)
+    return [raw[::-1].hex().upper() + ':' + port,
+            struct.pack('<4I', *struct.unpack('>4I', mapped)).hex().upper() + ':' + port]
+
+
+# Состояние ESTABLISHED в /proc/net/tcp
+TCP_ESTABLISHED = '01'
+TCP_STATE_ESTABLISHED = 1
+
+# sock_diag (как у ss): точный поиск сокета по адресам без чтения всей таблицы
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 1
+NLMSG_ERROR = 2
+INET_DIAG_NOCOOKIE = 0xFFFFFFFF
+NL_HEADER = struct.Struct('=IHHII')
+DIAG_REQUEST = struct.Struct('=BBBxI')
+# В inet_diag_msg: family, state, timer, retrans, sockid (48 байт), expires, rqueue, wqueue, uid, inode
+DIAG_STATE_OFFSET = 1
+DIAG_UID_OFFSET = 4 + 48 + 12
+DIAG_BATCH = 64
+
+
+def _diag_sockid(family, src, dst):
+    def addr(ip):
+        raw = socket.inet_pton(family, ip)
+        return raw + bytes(16 - len(raw))
+    return (struct.pack('>HH', src[1], dst[1]) + addr(src[0]) + addr(dst[0])
+            + struct.pack('=III', 0, INET_DIAG_NOCOOKIE, INET_DIAG_NOCOOKIE))
+
+
+def _unmap(ip):
+    return ip[7:] if ip.startswith('::ffff:') else ip
+
+
+def diag_lookup(pairs, timeout=1.0):
+    """{номер пары: (uid, inode)} для сокетов ESTABLISHED по (адрес сокета, адрес собеседника).
+
+    Все запросы пачки уходят одним сообщением netlink. OSError - sock_diag недоступен.
+    """
+    found = {}
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG) as sock:
+        sock.settimeout(timeout)
+        for start in range(0, len(pairs), DIAG_BATCH):
+            chunk = pairs[start:start + DIAG_BATCH]
+            message = b''
+            for seq, (src, dst) in enumerate(chunk, start):
+                src, dst = (_unmap(src[0]), src[1]), (_unmap(dst[0]), dst[1])
+                family = socket.AF_INET6 if ':' in src[0] else socket.AF_INET
+                body = (DIAG_REQUEST.pack(family, socket.IPPROTO_TCP, 0, 1 << TCP_STATE_ESTABLISHED)
+                        + _diag_sockid(family, src, dst))
+                message += NL_HEADER.pack(NL_HEADER.size + len(body), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST, seq, 0) + body
+            sock.send(message)
+            answered = 0
+            while answered < len(chunk):
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    break
+                offset = 0
+                while offset + NL_HEADER.size <= len(data):
+                    length, kind, _, seq, _ = NL_HEADER.unpack_from(data, offset)
+                    payload = offset + NL_HEADER.size
+                    answered += 1
+                    if kind != NLMSG_ERROR and data[payload + DIAG_STATE_OFFSET] == TCP_STATE_ESTABLISHED:
+                        uid, inode = struct.unpack_from('=II', data, payload + DIAG_UID_OFFSET)
+                        if inode:
+                            found[seq] = (uid, inode)
+                    offset += max(NL_HEADER.size, (length + 3) & ~3)
+    return found
+
+
+class OwnerResolver:
+    """Определяет приложение (Android: UID/пакет) или процесс (desktop) по адресу клиента"""
+    def __init__(self, cache_ttl=2.0, scan_interval=0.25):
+        self.cache_ttl = cache_ttl
+        self.scan_interval = scan_interval
+        self._proc_scan = 0.0
+        self._inode_pids = {}
+        self._inode_scan = 0.0
+        self._uid_names = {}
+        self._diag = True
+        self._lock = threading.Lock()
+
+    def resolve(self, peer, local=None):
+        """peer - (ip, port) клиентского сокета, local - адрес ретранслятора"""
+        return self.resolve_many([(peer, local)])[0]
+
+    def resolve_many(self, requests):
+        """Владельцы для списка (peer, local) за одно чтение таблицы сокетов"""
+        names = [None] * len(requests)
+        try:
+            if platform == 'android':
+                # С Android 10 /proc/net закрыт для приложений, спрашиваем систему
+                for i, (peer, local) in enumerate(requests):
+                    uid = self._android_owner_uid(peer, local) if local is not None else None
+                    if uid is not None:
+                        names[i] = self._android_package(uid)
+            missing = [i for i, name in enumerate(names) if name is None]
+            if missing:
+                peers = [tuple(requests[i][0][:2]) for i in missing]
+                if os.path.exists('/proc/net/tcp'):
+                    found = self._resolve_proc([(peer, requests[i][1]) for i, peer in zip(missing, peers)])
+                else:
+                    found = self._resolve_psutil(peers)
+                for i, peer in zip(missing, peers):
+                    names[i] = found.get(peer)
+        except Exception:
+            pass
+        return [name or UNKNOWN for name in names]
+
+    def _android_owner_uid(self, peer, local):
+        try:
+            from jnius import autoclass
+            activity = autoclass('org.kivy.android.PythonActivity').mActivity
+            context = autoclass('android.content.Context')
+            address = autoclass('java.net.InetSocketAddress')
+            manager = activity.getSystemService(context.CONNECTIVITY_SERVICE)
+            uid = manager.getConnectionOwnerUid(socket.IPPROTO_TCP, address(peer[0], peer[1]), address(local[0], local[1]))
+        except Exception:
+            return None
+        return uid if uid >= 0 else None
+
+    def _find_sockets(self, requests):
+        """{peer: (uid, inode)}: через sock_diag, а если он недоступен - из /proc"""
+        pairs = [(peer, local) for peer, local in requests if local is not None]
+        if pairs and self._diag:
+            try:
+                found = diag_lookup(pairs)
+            except OSError:
+                # Нет netlink (песочница, SELinux): дальше только /proc
+                self._diag = False
+            else:
+                return {tuple(pairs[seq][0][:2]): owner for seq, owner in found.items()}
+        # Чтение всей таблицы дорогое: не чаще раза в scan_interval, запросы тем временем копятся
+        delay = self._proc_scan + self.scan_interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._proc_scan = time.monotonic()
+        return self._scan_proc([peer for peer, _ in requests])
+
+    def _scan_proc(self, peers):
+        """{peer: (uid, inode)} для живых сокетов клиентов.
+
+        Строка разбирается целиком только при совпадении адреса. Сокеты не в
+        ESTABLISHED пропускаются: в TIME_WAIT у них uid 0 и inode 0.
+        """
+        wanted = {}
+        for peer in peers:
+            for key in _proc_keys(peer):
+                wanted[key] = peer
+        found = {}
+        for path in ('/proc/net/tcp', '/proc/net/tcp6'):
+            try:
+                with open(path) as f:
+                    next(f)
+                    for line in f:
+                        peer = wanted.get(line.split(None, 2)[1])
+                        if peer is None:
+                            continue
+                        fields = line.split()
+                        if fields[3] != TCP_ESTABLISHED or fields[9] == '0':
+                            continue
+                        found[peer] = (int(fields[7]), int(fields[9]))
+            except OSError:
+                continue
+        return found
+
+    def _resolve_proc(self, requests):
+        names = {}
+        for peer, (uid, inode) in self._find_sockets(requests).items():
+            if platform == 'android':
+                names[peer] = self._android_package(uid)
+                continue
+            pid = self._pid_for_inode(inode)
+            if pid is None:
+                names[peer] = f'uid:{uid}'
+                continue
+            try:
+                with open(f'/proc/{pid}/comm') as f:
+                    names[peer] = f'{f.read().strip()} ({pid})'
+            except OSError:
+                names[peer] = f'pid:{pid}'
+        return names
+
+    def _pid_for_inode(self, inode):
+        with self._lock:
+            pid = self._inode_pids.get(inode)
+            if pid is not None or time.monotonic() - self._inode_scan < self.cache_ttl:
+                return pid
+            self._inode_scan = time.monotonic()
+            mapping = {}
+            for name in os.listdir('/proc'):
+                if not name.isdigit():
+                    continue
+                fd_dir = f'/proc/{name}/fd'
+                try:
+                    for fd in os.listdir(fd_dir):
+                        target = os.readlink(f'{fd_dir}/{fd}')
+                        if target.startswith('socket:['):
+                            mapping[int(target[8:-1])] = int(name)
+                except OSError:
+                    continue
+            self._inode_pids = mapping
+            return mapping.get(inode)
+
+    def _android_package(self, uid):
+        name = self._uid_names.get(uid)
+        if name is None:
+            name = f'uid:{uid}'
+            try:
+                from jnius import autoclass
+                activity = autoclass('org.kivy.android.PythonActivity').mActivity
+                package = activity.getPackageManager().getNameForUid(uid)
+                if package:
+                    name = package
+            except Exception:
+                pass
+            self._uid_names[uid] = name
+        return name
+
+    def _resolve_psutil(self, peers):
+        try:
+            import psutil
+        except ImportError:
+            return {}
+        wanted = set(peers)
+        names = {}
+        for conn in psutil.net_connections(kind='tcp'):
+            if not conn.laddr or not conn.pid or conn.status != psutil.CONN_ESTABLISHED:
+                continue
+            peer = (conn.laddr.ip, conn.laddr.port)
+            if peer in wanted:
+                names[peer] = f'{psutil.Process(conn.pid).name()} ({conn.pid})'
+        return names
+
+
+def format_bytes(value):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if value < 1024 or unit == 'GB':
+            return f'{value:.0f} {unit}' if unit == 'B' else f'{value:.1f} {unit}'
+        value /= 1024
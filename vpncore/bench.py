@@ -0,0 +1,262 @@
+"""Замеры ретранслятора на loopback"""
+import asyncio
+import time
+
+from .accounting import UNKNOWN, TrafficAccounting
+from .relay import Relay
+
+CHUNK = 64 * 1024
+
+
+async def start_sink(host='127.0.0.1'):
+    """Сервер, который читает и выбрасывает все данные"""
+    async def handle(reader, writer):
+        while await reader.read(CHUNK):
+            pass
+        writer.close()
+    return await asyncio.start_server(handle, host, 0)
+
+
+async def _push(port, total, payload):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    sent = 0
+    while sent < total:
+        writer.write(payload)
+        await writer.drain()
+        sent += len(payload)
+    writer.write_eof()
+    await reader.read()
+    writer.close()
+
+
+async def relay_throughput(accounting=None, streams=4, megabytes=64):
+    """Пропускная способность ретранслятора в МБ/с"""
+    sink = await start_sink()
+    sink_port = sink.sockets[0].getsockname()[1]
+    relay = Relay(('127.0.0.1', sink_port), port=0, accounting=accounting)
+    await relay.start()
+    payload = b'x' * CHUNK
+    per_stream = megabytes * 1024 * 1024 // streams
+    start = time.perf_counter()
+    await asyncio.gather(*[_push(relay.port, per_stream, payload) for _ in range(streams)])
+    elapsed = time.perf_counter() - start
+    await relay.close()
+    sink.close()
+    return per_stream * streams / elapsed / (1024 * 1024)
+
+
+async def start_reply_sink(size, host='127.0.0.1'):
+    """Сервер, который на строку запроса отвечает size байт и закрывает соединение"""
+    reply = b'x' * size
+
+    async def handle(reader, writer):
+        try:
+            await reader.readline()
+            writer.write(reply)
+            await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        writer.close()
+    return await asyncio.start_server(handle, host, 0, backlog=1024)
+
+
+async def _request(port, size):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'GET\n')
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    return len(data) == size
+
+
+async def relay_requests(accounting=None, requests=1000, concurrency=50, size=4096):
+    """Короткие запросы (как HTTP без keep-alive) через ретранслятор, запросов в секунду"""
+    sink = await start_reply_sink(size)
+    relay = Relay(('127.0.0.1', sink.sockets[0].getsockname()[1]), port=0, accounting=accounting)
+    await relay.start()
+    queue = iter(range(requests))
+
+    async def worker():
+        for _ in queue:
+            await _request(relay.port, size)
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    await relay.close()
+    sink.close()
+    return requests / elapsed
+
+
+def counter_cost(chunks=200000):
+    """Стоимость одного увеличения счетчика в наносекундах"""
+    accounting = TrafficAccounting(max_flows=16)
+    counters = accounting.up
+    flow_id = accounting.open_flow()
+    start = time.perf_counter()
+    for _ in range(chunks):
+        counters[flow_id] += CHUNK
+    loop_cost = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(chunks):
+        pass
+    empty_cost = time.perf_counter() - start
+    return max(0.0, loop_cost - empty_cost) / chunks * 1e9
+
+
+def bench_accounting(rounds=3, streams=4, megabytes=64, requests=1000):
+    """Сравнивает ретранслятор с учетом трафика и без него.
+
+    Длинные передачи проверяют счетчики горячего пути, короткие запросы -
+    стоимость открытия потока и поиска владельца.
+    """
+    async def run():
+        base = []
+        counted = []
+        base_requests = []
+        counted_requests = []
+        for _ in range(rounds):
+            base.append(await relay_throughput(None, streams, megabytes))
+            counted.append(await relay_throughput(TrafficAccounting(), streams, megabytes))
+            base_requests.append(await relay_requests(None, requests))
+            accounting = TrafficAccounting()
+            counted_requests.append(await relay_requests(accounting, requests))
+        # Итоги последнего прогона учитываются после ответа на все поиски владельцев
+        for _ in range(100):
+            if not accounting.lookups_pending():
+                break
+            await asyncio.sleep(0.05)
+        attributed = sum(row['flows'] for row in accounting.breakdown() if row['owner'] != UNKNOWN)
+        return max(base), max(counted), max(base_requests), max(counted_requests), attributed / requests
+    base, counted, base_requests, counted_requests, attributed = asyncio.run(run())
+    return {
+        'relay_mb_s': round(base, 1),
+        'relay_with_accounting_mb_s': round(counted, 1),
+        'overhead_percent': round(max(0.0, (base - counted) / base * 100), 2),
+        'requests_per_s': round(base_requests, 1),
+        'requests_with_accounting_per_s': round(counted_requests, 1),
+        'requests_overhead_percent': round(max(0.0, (base_requests - counted_requests) / base_requests * 100), 2),
+        'requests_attributed_percent': round(attributed * 100, 1),
+        'counter_update_ns': round(counter_cost(), 1),
+    }
+
+
+async def start_limited_sink(rate, host='127.0.0.1'):
+    """Сервер-заглушка с общей на все подключения полосой rate байт/с"""
+    loop = asyncio.get_running_loop()
+    next_free = [loop.time()]
+
+    async def handle(reader, writer):
+        while True:
+            data = await reader.read(CHUNK)
+            if not data:
+                break
+            # Полоса общая: каждый блок занимает интервал len/rate после предыдущего
+            now = loop.time()
+            slot = max(now, next_free[0]) + len(data) / rate
+            next_free[0] = slot
+            await asyncio.sleep(slot - now)
+        writer.close()
+    return await asyncio.start_server(handle, host, 0)
+
+
+async def bonded_throughput(rates, streams=6, megabytes=24, bonded=True, kill_after=None):
+    """Суммарная скорость через один лучший сервер или через связку серверов, МБ/с.
+
+    kill_after - через сколько секунд остановить самый быстрый сервер (проверка
+    перехода на оставшиеся пути).
+    """
+    from .bonding import BondedRelay, Path
+    from .config import Endpoint
+    sinks = [await start_limited_sink(rate * 1024 * 1024) for rate in rates]
+    paths = [Path(Endpoint('tcp', '127.0.0.1', sink.sockets[0].getsockname()[1], 'tcp', '', f'sink{i}'),
+                  rtt=0.001 * (i + 1))
+             for i, sink in enumerate(sinks)]
+    if bonded:
+        relay = BondedRelay(paths, port=0)
+    else:
+        relay = Relay(paths[0].target, port=0)
+    await relay.start()
+    payload = b'x' * CHUNK
+    per_stream = megabytes * 1024 * 1024 // streams
+    killer = None
+    if kill_after is not None:
+        async def kill():
+            await asyncio.sleep(kill_after)
+            sinks[0].close()
+        killer = asyncio.ensure_future(kill())
+    start = time.perf_counter()
+    results = await asyncio.gather(*[_push(relay.port, per_stream, payload) for _ in range(streams)],
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    if killer is not None:
+        killer.cancel()
+    stats = relay.stats()
+    await relay.close()
+    for sink in sinks:
+        sink.close()
+    done = sum(1 for r in results if not isinstance(r, Exception))
+    return per_stream * done / elapsed / (1024 * 1024), stats
+
+
+def bench_bonding(rates=(8, 4, 2), streams=6, megabytes=24):
+    """Сравнивает один сервер со связкой на заглушках с ограниченной полосой"""
+    async def run():
+        single, _ = await bonded_throughput(rates, streams, megabytes, bonded=False)
+        bonded, stats = await bonded_throughput(rates, streams, megabytes)
+        return single, bonded, stats
+    single, bonded, stats = asyncio.run(run())
+    return {
+        'limits_mb_s': '/'.join(str(rate) for rate in rates),
+        'single_mb_s': round(single, 2),
+        'bonded_mb_s': round(bonded, 2),
+        'speedup': round(bonded / single, 2) if single else None,
+        'flows_per_path': '/'.join(str(p['flows']) for p in stats['paths']),
+    }
+
+
+def _text_payload(size):
+    """Похожие на JSON-ответы API данные"""
+    line = b'{"id": %d, "name": "server-%d", "region": "USA", "latency_ms": %d, "status": "ok"}\n'
+    out = bytearray()
+    i = 0
+    while len(out) < size:
+        out += line % (i, i % 97, i % 300)
+        i += 1
+    return bytes(out[:size])
+
+
+async def compressed_transfer(payload, codec, megabytes=16):
+    """Клиент -> сжимающий ретранслятор -> распаковывающий -> приемник"""
+    sink = await start_sink()
+    peer = Relay(('127.0.0.1', sink.sockets[0].getsockname()[1]), port=0, compression='decompress', codec=codec)
+    await peer.start()
+    client = Relay(('127.0.0.1', peer.port), port=0, compression='compress', codec=codec)
+    await client.start()
+    start = time.perf_counter()
+    await _push(client.port, megabytes * 1024 * 1024, payload)
+    elapsed = time.perf_counter() - start
+    stats = client.compression_stats.snapshot()
+    await client.close()
+    await peer.close()
+    sink.close()
+    return megabytes / elapsed, stats
+
+
+def bench_compression(megabytes=16):
+    """Степень сжатия и стоимость для текста и для несжимаемых данных"""
+    import os
+    from .compression import available_codecs
+    payloads = {'text': _text_payload(CHUNK), 'random': os.urandom(CHUNK)}
+    rows = []
+    for codec in available_codecs():
+        for kind, payload in payloads.items():
+            speed, stats = asyncio.run(compressed_transfer(payload, codec, megabytes))
+            rows.append({
+                'codec': codec,
+                'payload': kind,
+                'mb_s': round(speed, 1),
+                'compressed': stats['flows_compressed'] > 0,
+                'ratio': stats['ratio'],
+                'cpu_ms_per_mb': round(stats['cpu_ms'] / megabytes, 2),
+            })
+    return rows
@@ -0,0 +1,183 @@
+"""Многопутевой режим: потоки распределяются между несколькими серверами"""
+import asyncio
+import time
+
+from .relay import Relay
+
+# Поток короче этого не дает осмысленной оценки пропускной способности
+MIN_SAMPLE_BYTES = 256 * 1024
+
+
+class Path:
+    """Один сервер в связке и его измерения"""
+    def __init__(self, endpoint, address=None, rtt=None):
+        self.endpoint = endpoint
+        self.address = address or endpoint.host
+        self.rtt = rtt
+        self.throughput = None
+        self.active_flows = 0
+        self.total_flows = 0
+        self.bytes = 0
+        self.failures = 0
+        self.down_until = 0.0
+        self.sampled_at = 0.0
+        self.current_weight = 0.0
+
+    @property
+    def target(self):
+        return self.address, self.endpoint.port
+
+    def record_flow(self, nbytes, duration, now, alpha=0.3):
+        """duration - время активной передачи потока, без простоев"""
+        self.bytes += nbytes
+        if nbytes >= MIN_SAMPLE_BYTES and duration > 0:
+            sample = nbytes / duration
+            self.throughput = sample if self.throughput is None else self.throughput * (1 - alpha) + sample * alpha
+            self.sampled_at = now
+
+
+class BondingScheduler:
+    """Взвешенный round-robin (smooth WRR) по пропускной способности и RTT.
+
+    Путь с ошибками подключения или с пропускной способностью ниже degrade_ratio
+    от лучшего временно исключается; если остается один путь, работаем как обычно.
+    Оценка старше sample_ttl не учитывается: медленный путь, не получавший
+    потоков, снова получает их и перемеряется, а не исключается навсегда.
+    """
+    def __init__(self, paths, degrade_ratio=0.2, failure_limit=2, cooldown=30.0, sample_ttl=None,
+                 clock=time.monotonic):
+        self.paths = list(paths)
+        self.degrade_ratio = degrade_ratio
+        self.failure_limit = failure_limit
+        self.cooldown = cooldown
+        self.sample_ttl = cooldown if sample_ttl is None else sample_ttl
+        self.clock = clock
+
+    def throughput(self, path, now):
+        """Действующая оценка пути или None, если замера нет или он устарел"""
+        if path.throughput is None or now - path.sampled_at > self.sample_ttl:
+            return None
+        return path.throughput
+
+    def healthy_paths(self):
+        now = self.clock()
+        alive = [p for p in self.paths if p.down_until <= now]
+        measured = [self.throughput(p, now) for p in alive]
+        if any(measured):
+            floor = max(t for t in measured if t) * self.degrade_ratio
+            alive = [p for p, t in zip(alive, measured) if t is None or t >= floor]
+        return alive or self.paths[:1]
+
+    @property
+    def single_path(self):
+        return len(self.healthy_paths()) == 1
+
+    def weights(self, paths):
+        now = self.clock()
+        current = [self.throughput(p, now) for p in paths]
+        measured = [t for t in current if t]
+        default = sum(measured) / len(measured) if measured else 1.0
+        rtts = [p.rtt for p in paths if p.rtt]
+        best_rtt = min(rtts) if rtts else None
+        weights = []
+        for p, throughput in zip(paths, current):
+            weight = throughput or default
+            if best_rtt and p.rtt:
+                weight *= (best_rtt / p.rtt) ** 0.5
+            weights.append(weight)
+        return weights
+
+    def choose(self, exclude=()):
+        """Следующий путь для нового потока"""
+        paths = [p for p in self.healthy_paths() if p not in exclude]
+        if not paths:
+            return None
+        weights = self.weights(paths)
+        total = sum(weights)
+        for path, weight in zip(paths, weights):
+            path.current_weight += weight
+        best = max(paths, key=lambda p: p.current_weight)
+        best.current_weight -= total
+        return best
+
+    def record_failure(self, path):
+        path.failures += 1
+        if path.failures >= self.failure_limit:
+            path.down_until = self.clock() + self.cooldown
+            path.failures = 0
+
+    def record_success(self, path):
+        path.failures = 0
+
+    def record_flow(self, path, nbytes, duration):
+        now = self.clock()
+        if self.throughput(path, now) is None:
+            # Устаревшая оценка не смешивается с новым замером
+            path.throughput = None
+        path.record_flow(nbytes, duration, now)
+
+    def stats(self):
+        healthy = self.healthy_paths()
+        return [{
+            'server': f'{p.endpoint.host}:{p.endpoint.port}',
+            'active': p in healthy,
+            'rtt_ms': round(p.rtt * 1000, 1) if p.rtt else None,
+            'throughput_mb_s': round(p.throughput / (1024 * 1024), 2) if p.throughput else None,
+            'flows': p.total_flows,
+            'active_flows': p.active_flows,
+            'bytes': p.bytes,
+        } for p in self.paths]
+
+
+def select_paths(results, max_paths=3, first=None):
+    """Лучшие доступные серверы из результатов проверки (ProbeResult).
+
+    first - сервер, выбранный для подключения (в том числе вручную): он
+    остается первым путем, остальные добавляются по задержке.
+    """
+    reachable = [r for r in results if r.ok]
+    reachable.sort(key=lambda r: (r.endpoint != first, r.latency is None, r.latency or 0))
+    return [Path(r.endpoint, r.address, r.latency) for r in reachable[:max_paths]]
+
+
+class BondedRelay(Relay):
+    """Ретранслятор, раскладывающий потоки по нескольким серверам.
+
+    Разбиение одного TCP-потока на куски между серверами требует сборки на
+    стороне сервера, которой у протоколов из конфигурации нет, поэтому
+    распределяются целые потоки.
+    """
+    measure_activity = True
+
+    def __init__(self, paths, **kwargs):
+        self.scheduler = BondingScheduler(paths)
+        self._flow_paths = {}
+        super().__init__(upstream=None, **kwargs)
+
+    async def open_upstream(self, flow_id):
+        tried = []
+        while True:
+            path = self.scheduler.choose(exclude=tried)
+            if path is None:
+                raise ConnectionError('Нет доступных серверов')
+            try:
+                up_reader, up_writer = await asyncio.wait_for(
+                    asyncio.open_connection(*path.target), self.connect_timeout)
+            except (OSError, asyncio.TimeoutError):
+                self.scheduler.record_failure(path)
+                tried.append(path)
+                continue
+            self.scheduler.record_success(path)
+            path.active_flows += 1
+            path.total_flows += 1
+            self._flow_paths[up_writer] = path
+            return up_reader, up_writer
+
+    def flow_closed(self, up_writer, nbytes, elapsed):
+        path = self._flow_paths.pop(up_writer, None)
+        if path is not None:
+            path.active_flows -= 1
+            self.scheduler.record_flow(path, nbytes, elapsed)
+
+    def stats(self):
+        return dict(super().stats(), paths=self.scheduler.stats(), single_path=self.scheduler.single_path)
@@ -0,0 +1,223 @@
+"""Каталог регионов и серверов с индексами и быстрым поиском"""
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+from .regions import REGIONS, endpoints_for_region
+
+REGION = 'region'
+SERVER = 'server'
+MAX_RECENTS = 5
+# Минимальная доля общих триграмм (от большего из слов) для нечеткого совпадения
+FUZZY_THRESHOLD = 0.4
+
+Entry = namedtuple('Entry', 'key kind title country city protocol tags flag endpoint')
+
+_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+def words(text):
+    return _WORD.findall(normalize(text))
+
+
+def trigrams(word):
+    padded = f' {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def server_key(endpoint):
+    return f'{endpoint.protocol}://{endpoint.host}:{endpoint.port}'
+
+
+def _city(name, country):
+    """Город из имени сервера: то, что осталось после страны, без номеров и флагов"""
+    rest = re.sub(re.escape(country), ' ', name or '', flags=re.IGNORECASE)
+    parts = [w for w in _WORD.findall(rest) if not w.isdigit() and w.lower() not in ('server', 'vpn', 'node')]
+    return ' '.join(parts[:2]).title()
+
+
+def build_entries(endpoints=(), regions=REGIONS):
+    """Записи каталога: по одной на регион и на каждый сервер конфигурации"""
+    entries = []
+    for country, flag in regions:
+        entries.append(Entry(country, REGION, country, country, '', '', frozenset(), flag, None))
+    assigned = set()
+    for country, flag in regions:
+        for endpoint in endpoints_for_region(endpoints, country):
+            if endpoint in assigned:
+                continue
+            assigned.add(endpoint)
+            entries.append(_server_entry(endpoint, country, flag))
+    for endpoint in endpoints:
+        if endpoint not in assigned:
+            entries.append(_server_entry(endpoint, '', ''))
+    return entries
+
+
+def _server_entry(endpoint, country, flag):
+    tags = frozenset(t for t in (endpoint.transport, endpoint.security) if t and t != 'none')
+    title = endpoint.name or f'{endpoint.host}:{endpoint.port}'
+    return Entry(server_key(endpoint), SERVER, title, country, _city(endpoint.name, country),
+                 endpoint.protocol, tags, flag, endpoint)
+
+
+class ServerCatalog:
+    """Индексы по стране, городу, протоколу, тегу и доступности плюс поиск.
+
+    Поиск идет по заранее построенным индексам префиксов и триграмм, а
+    результат по каждому слову запроса кэшируется: при наборе текста заново
+    считается только последнее слово.
+    """
+    def __init__(self, entries=(), cache_size=256):
+        self._lock = threading.RLock()
+        self.cache_size = cache_size
+        self.favourites = set()
+        self.recents = []
+        self.health = {}
+        self.set_entries(entries)
+
+    def set_entries(self, entries):
+        """Заменяет записи; индексы строятся без блокировки, поиск не ждет"""
+        entries = list(entries)
+        indexes = {'country': {}, 'city': {}, 'protocol': {}, 'tag': {}}
+        prefix, grams, vocabulary = {}, {}, {}
+        for i, entry in enumerate(entries):
+            for field, value in (('country', entry.country), ('city', entry.city), ('protocol', entry.protocol)):
+                if value:
+                    indexes[field].setdefault(normalize(value), set()).add(i)
+            for tag in entry.tags:
+                indexes['tag'].setdefault(normalize(tag), set()).add(i)
+            text = ' '.join([entry.title, entry.country, entry.city, entry.protocol, *entry.tags])
+            for word in set(words(text)):
+                vocabulary.setdefault(word, set()).add(i)
+                for n in range(1, len(word) + 1):
+                    prefix.setdefault(word[:n], set()).add(i)
+                for gram in trigrams(word):
+                    grams.setdefault(gram, set()).add(word)
+        with self._lock:
+            self.entries = entries
+            self.by_key = {entry.key: i for i, entry in enumerate(entries)}
+            self.indexes = indexes
+            self._prefix = prefix
+            self._trigrams = grams
+            self._words = vocabulary
+            self._token_cache = OrderedDict()
+            self._reindex_health()
+
+    def _reindex_health(self):
+        index = self.indexes['health'] = {True: set(), False: set(), None: set()}
+        for i, entry in enumerate(self.entries):
+            index[self.health.get(entry.key)].add(i)
+
+    def set_health(self, health):
+        """health - {key записи: True/False/None}"""
+        with self._lock:
+            self.health = dict(health)
+            self._reindex_health()
+
+    def filter(self, **criteria):
+        """Номера записей по индексам, например filter(country='usa', health=True)"""
+        with self._lock:
+            result = None
+            for field, value in criteria.items():
+                key = value if field == 'health' else normalize(value)
+                ids = self.indexes[field].get(key, set())
+                result = set(ids) if result is None else result & ids
+            return set(range(len(self.entries))) if result is None else result
+
+    def _match_token(self, token):
+        """{номер записи: оценка} для одного слова запроса"""
+        cached = self._token_cache.get(token)
+        if cached is not None:
+            self._token_cache.move_to_end(token)
+            return cached
+        scores = dict.fromkeys(self._prefix.get(token, ()), 1.0)
+        if len(token) >= 3:
+            # Нечеткое совпадение ищется по словарю слов, а не по записям
+            grams = trigrams(token)
+            shared = {}
+            for gram in grams:
+                for word in self._trigrams.get(gram, ()):
+                    shared[word] = shared.get(word, 0) + 1
+            for word, count in shared.items():
+                similarity = count / max(len(grams), len(word))
+                if similarity >= FUZZY_THRESHOLD:
+                    for i in self._words[word]:
+                        if scores.get(i, 0) < similarity:
+                            scores[i] = similarity
+        self._token_cache[token] = scores
+        if len(self._token_cache) > self.cache_size:
+            self._token_cache.popitem(last=False)
+        return scores
+
+    def search(self, query='', limit=50, **criteria):
+        """Записи по запросу: закрепленные первыми, затем по совпадению и доступности"""
+        with self._lock:
+            tokens = words(query)
+            candidates = self.filter(**criteria) if criteria else None
+            scores = None
+            for token in tokens:
+                matched = self._match_token(token)
+                if scores is None:
+                    scores = dict(matched)
+                else:
+                    scores = {i: s + matched[i] for i, s in scores.items() if i in matched}
+                if not scores:
+                    break
+            if scores is None:
+                ids = candidates if candidates is not None else range(len(self.entries))
+                scores = {i: 0.0 for i in ids}
+            elif candidates is not None:
+                scores = {i: s for i, s in scores.items() if i in candidates}
+            ranked = sorted(scores, key=lambda i: self._rank(i, scores[i]))
+            return [self.entries[i] for i in ranked[:limit]]
+
+    def _rank(self, i, score):
+        entry = self.entries[i]
+        if entry.key in self.favourites:
+            pin = 0
+        elif entry.key in self.recents:
+            pin = 1 + self.recents.index(entry.key)
+        else:
+            pin = MAX_RECENTS + 1
+        healthy = self.health.get(entry.key)
+        return (pin, -score, healthy is False, entry.kind != REGION, entry.title)
+
+    def get(self, key):
+        i = self.by_key.get(key)
+        return self.entries[i] if i is not None else None
+
+    def toggle_favourite(self, key):
+        with self._lock:
+            if key in self.favourites:
+                self.favourites.discard(key)
+                return False
+            self.favourites.add(key)
+            return True
+
+    def favourite_endpoints(self):
+        """Серверы избранного: отмеченные серверы и все серверы отмеченных регионов"""
+        with self._lock:
+            return [entry.endpoint for entry in self.entries if entry.endpoint is not None
+                    and (entry.key in self.favourites or entry.country in self.favourites)]
+
+    def add_recent(self, key):
+        with self._lock:
+            if key in self.recents:
+                self.recents.remove(key)
+            self.recents.insert(0, key)
+            del self.recents[MAX_RECENTS:]
+
+    def export_pins(self):
+        return {'favourites': sorted(self.favourites), 'recents': list(self.recents)}
+
+    def restore_pins(self, pins):
+        if not pins:
+            return
+        with self._lock:
+            self.favourites = set(pins.get('favourites', ()))
+            self.recents = list(pins.get('recents', ()))[:MAX_RECENTS]
@@ -0,0 +1,385 @@
+"""Консольный клиент и демон IKISKY VPN"""
+import argparse
+import json
+import signal
+import statistics
+import sys
+import threading
+import time
+
+from .accounting import TrafficAccounting, format_bytes
+from .config import ConfigDatabase
+from .connection import ConnectionManager, VPNError
+from .control import CONTROL_PORT, DEFAULT_RELAY_PORT, ControlError, ControlServer, send_command
+from .health import HealthMonitor
+from .paths import CONFIG_FILE, SESSION_FILE
+from .probe import DEFAULT_TIMEOUT, probe_many
+from .regions import endpoints_for_region, region_names
+from .scheduler import IDLE, NORMAL, TaskScheduler
+from .session import SessionStore, capture_session, restore_session
+from .validation import ConfigValidator
+
+
+def _print(data, as_json):
+    if as_json:
+        print(json.dumps(data, ensure_ascii=False, indent=2))
+        return
+    if isinstance(data, dict):
+        for key, value in data.items():
+            print(f'{key}: {value}')
+    elif data:
+        print('  '.join(data[0].keys()))
+        for row in data:
+            print('  '.join(str(value) for value in row.values()))
+
+
+def _format_ms(latency):
+    return round(latency * 1000, 1) if latency is not None else None
+
+
+def cmd_daemon(args):
+    health = HealthMonitor()
+    accounting = TrafficAccounting()
+    config_db = ConfigDatabase(args.config)
+    manager = ConnectionManager(config_db, health=health, accounting=accounting,
+                                relay_port=args.relay_port, bonding=args.bonding, compression=args.compress)
+    manager.add_listener(lambda m: health.set_priority([m.endpoint] if m.endpoint else m.region_endpoints()))
+    try:
+        health.set_endpoints(manager.endpoints())
+        health.set_priority(manager.region_endpoints())
+    except ValueError as e:
+        print(f'Конфигурация не разобрана: {e}', file=sys.stderr)
+
+    def health_tick():
+        health.run_due()
+        return min(max(health.next_due(), 1.0), 30.0)
+
+    scheduler = TaskScheduler()
+    scheduler.register('health', health_tick, 1.0, NORMAL, run_now=True)
+    scheduler.register('traffic_flush', accounting.flush, 1.0, IDLE)
+    server = ControlServer(manager, port=args.port, scheduler=scheduler)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    server.start()
+    if args.session:
+        store = SessionStore(args.session, vault=config_db.vault)
+
+        def restore():
+            state = store.load()
+            if args.auto_reconnect:
+                state['auto_reconnect'] = args.auto_reconnect == 'on'
+            restore_session(manager, state)
+            # Сохранять начинаем только после восстановления, чтобы не затереть прошлую сессию
+            # Закрепленные в приложении записи каталога демон не меняет, но сохраняет
+            save = lambda m: store.save(dict(capture_session(m, state.get('auto_reconnect', True)),
+                                             pins=state.get('pins')))
+            manager.add_listener(save)
+            save(manager)
+
+        threading.Thread(target=restore, daemon=True).start()
+    threading.Thread(target=scheduler.run_forever, args=(stop,), daemon=True).start()
+    print(f'Демон слушает 127.0.0.1:{args.port}', flush=True)
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        stop.set()
+    server.shutdown()
+    health.stop()
+    return 0
+
+
+def cmd_connect(args):
+    _print(send_command('connect', port=args.port, region=args.region), args.json)
+    return 0
+
+
+def cmd_disconnect(args):
+    _print(send_command('disconnect', port=args.port), args.json)
+    return 0
+
+
+def cmd_status(args):
+    _print(send_command('status', port=args.port), args.json)
+    return 0
+
+
+def cmd_health(args):
+    _print(send_command('health', port=args.port), args.json)
+    return 0
+
+
+def cmd_traffic(args):
+    rows = send_command('traffic', port=args.port)
+    if not args.json:
+        rows = [dict(row, bytes_up=format_bytes(row['bytes_up']), bytes_down=format_bytes(row['bytes_down']))
+                for row in rows]
+    _print(rows, args.json)
+    return 0
+
+
+def cmd_tasks(args):
+    _print(send_command('tasks', port=args.port), args.json)
+    return 0
+
+
+def cmd_list_regions(args):
+    manager = ConnectionManager(ConfigDatabase(args.config))
+    endpoints = manager.endpoints()
+    results = {}
+    for result in probe_many(endpoints, args.timeout):
+        results[result.endpoint] = result
+    rows = []
+    for region in region_names():
+        region_results = [results[ep] for ep in endpoints_for_region(endpoints, region)]
+        latencies = [r.latency for r in region_results if r.ok and r.latency is not None]
+        rows.append({
+            'region': region,
+            'servers': len(region_results),
+            'healthy': sum(1 for r in region_results if r.ok),
+            'latency_ms': _format_ms(min(latencies)) if latencies else None,
+        })
+    if args.sort == 'latency':
+        rows.sort(key=lambda row: (row['latency_ms'] is None, row['latency_ms'] or 0))
+    _print(rows, args.json)
+    return 0
+
+
+def cmd_bench(args):
+    if args.suite == 'accounting':
+        from .bench import bench_accounting
+        _print(bench_accounting(rounds=args.rounds), args.json)
+        return 0
+    if args.suite == 'bonding':
+        from .bench import bench_bonding
+        _print(bench_bonding(), args.json)
+        return 0
+    if args.suite == 'compression':
+        from .bench import bench_compression
+        _print(bench_compression(), args.json)
+        return 0
+    manager = ConnectionManager(ConfigDatabase(args.config))
+    endpoints = manager.endpoints()
+    samples = {ep: [] for ep in endpoints}
+    for _ in range(args.rounds):
+        for result in probe_many(endpoints, args.timeout):
+            if result.ok and result.latency is not None:
+                samples[result.endpoint].append(result.latency)
+    rows = []
+    for ep, values in samples.items():
+        rows.append({
+            'server': f'{ep.host}:{ep.port}',
+            'ok': f'{len(values)}/{args.rounds}',
+            'min_ms': _format_ms(min(values)) if values else None,
+            'median_ms': _format_ms(statistics.median(values)) if values else None,
+            'max_ms': _format_ms(max(values)) if values else None,
+        })
+    _print(rows, args.json)
+    return 0
+
+
+def cmd_peer(args):
+    from .relay import Relay, RelayThread
+    host, _, port = args.upstream.rpartition(':')
+    relay = RelayThread(Relay((host, int(port)), host=args.listen, port=args.listen_port, compression='decompress',
+                              codec=args.codec))
+    relay.start()
+    print(f'Ретранслятор сжатия {args.listen}:{relay.relay.port} -> {args.upstream}', file=sys.stderr)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        stop.set()
+    relay.stop()
+    return 0
+
+
+def cmd_loadtest(args):
+    from .loadtest import compare_reports, load_report, run_loadtest, save_report
+    if args.relay_port and not args.sink_port:
+        print('С --relay-port нужен --sink-port: на этот порт должен вести upstream ретранслятора',
+              file=sys.stderr)
+        return 2
+    report = run_loadtest(requests=args.requests, concurrency=args.concurrency, response_size=args.response_size,
+                          bulk_streams=args.bulk_streams, bulk_megabytes=args.bulk_mb, idle=args.idle,
+                          relay_port=args.relay_port, sink_port=args.sink_port)
+    if args.output:
+        save_report(report, args.output)
+    if args.compare:
+        _print(compare_reports(load_report(args.compare), report), args.json)
+    elif args.json:
+        _print(report, True)
+    else:
+        _print({key: value for key, value in report.items() if key not in ('params', 'relay')}, False)
+    return 0 if report['errors'] == 0 else 1
+
+
+def cmd_search(args):
+    from .catalog import ServerCatalog, build_entries
+    config_db = ConfigDatabase(args.config)
+    manager = ConnectionManager(config_db)
+    try:
+        endpoints = manager.endpoints()
+    except ValueError:
+        endpoints = []
+    catalog = ServerCatalog(build_entries(endpoints))
+    catalog.restore_pins(SessionStore(args.session, vault=config_db.vault).load().get('pins'))
+    criteria = {field: getattr(args, field) for field in ('country', 'city', 'protocol', 'tag') if getattr(args, field)}
+    rows = [{
+        'title': entry.title,
+        'kind': entry.kind,
+        'country': entry.country,
+        'city': entry.city,
+        'protocol': entry.protocol,
+        'tags': ','.join(sorted(entry.tags)),
+    } for entry in catalog.search(args.query, limit=args.limit, **criteria)]
+    _print(rows, args.json)
+    return 0
+
+
+def cmd_vault(args):
+    start = time.perf_counter()
+    db = ConfigDatabase(args.config)
+    opened = time.perf_counter() - start
+    # Открытый файл старого формата шифруется сразу, а не при следующем запуске демона
+    db.migrate()
+    info = {
+        'encrypted': db.encrypted,
+        'available': db.vault is not None,
+        'backend': db.vault.keystore.backend if db.vault else None,
+        # False - секрет лежит открыто рядом с данными: шифрование на диске не защищает
+        'protected': db.vault.keystore.protected if db.vault else None,
+        'profiles': ','.join(db.profile_names()),
+        'active': db.active_profile() if db.encrypted else None,
+        'open_ms': round(opened * 1000, 2),
+    }
+    start = time.perf_counter()
+    db.get_config()
+    info['first_read_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    info['unlock_ms'] = round(db.vault.unlock_time * 1000, 2) if db.vault and db.vault.unlock_time else None
+    info['error'] = db.error
+    _print(info, args.json)
+    return 0
+
+
+def cmd_validate(args):
+    text = sys.stdin.read() if args.file == '-' else open(args.file, encoding='utf-8').read()
+
+    def on_event(event):
+        if event.kind == 'probe' and not args.json:
+            result = event.data
+            state = 'OK' if result.ok else 'FAIL'
+            print(f'{state}  {result.endpoint.host}:{result.endpoint.port}  {result.error}', flush=True)
+
+    report = ConfigValidator(deadline=args.deadline).validate(text, on_event)
+    if args.json:
+        _print({
+            'ok': report.ok,
+            'saveable': report.saveable,
+            'error': report.error,
+            'timed_out': report.timed_out,
+            'servers': [{
+                'server': f'{r.endpoint.host}:{r.endpoint.port}',
+                'ok': r.ok,
+                'latency_ms': _format_ms(r.latency),
+                'detail': r.error,
+            } for r in report.results],
+        }, True)
+    else:
+        print(report.summary())
+    return 0 if report.ok else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='vpncore', description='IKISKY VPN без графического интерфейса')
+    parser.add_argument('--config', default=CONFIG_FILE, help='файл конфигурации')
+    parser.add_argument('--port', type=int, default=CONTROL_PORT, help='порт управляющего сокета')
+    parser.add_argument('--json', action='store_true', help='вывод в JSON')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    daemon = sub.add_parser('daemon', help='запустить демон')
+    daemon.add_argument('--relay-port', type=int, default=DEFAULT_RELAY_PORT,
+                        help='порт локального ретранслятора на 127.0.0.1')
+    daemon.add_argument('--bonding', type=int, default=0, metavar='N',
+                        help='распределять потоки между N лучшими серверами (2-3), 0 - один сервер')
+    daemon.add_argument('--session', default=SESSION_FILE,
+                        help="файл сессии для восстановления подключения ('' - не сохранять)")
+    daemon.add_argument('--auto-reconnect', choices=('on', 'off'),
+                        help='переподключаться при запуске к прошлому серверу (сохраняется в сессии)')
+    daemon.add_argument('--compress', choices=('auto', 'zlib', 'zstd', 'lz4'),
+                        help='сжимать потоки к серверу; сервер должен быть ретранслятором peer')
+    daemon.set_defaults(func=cmd_daemon)
+
+    peer = sub.add_parser('peer', help='ретранслятор на стороне сервера: распаковывает потоки демона')
+    peer.add_argument('upstream', help='host:port, куда пересылать распакованные потоки')
+    peer.add_argument('--listen', default='0.0.0.0')
+    peer.add_argument('--listen-port', type=int, default=DEFAULT_RELAY_PORT)
+    peer.add_argument('--codec', choices=('auto', 'zlib', 'zstd', 'lz4'), default='zlib',
+                      help='кодек для ответов клиенту')
+    peer.set_defaults(func=cmd_peer)
+
+    connect = sub.add_parser('connect', help='подключиться')
+    connect.add_argument('--region', help='регион, например USA')
+    connect.set_defaults(func=cmd_connect)
+
+    sub.add_parser('disconnect', help='отключиться').set_defaults(func=cmd_disconnect)
+    sub.add_parser('status', help='состояние подключения').set_defaults(func=cmd_status)
+    sub.add_parser('health', help='состояние серверов по данным демона').set_defaults(func=cmd_health)
+    sub.add_parser('traffic', help='трафик по приложениям').set_defaults(func=cmd_traffic)
+    sub.add_parser('tasks', help='периодические задачи демона и их процессорное время').set_defaults(func=cmd_tasks)
+
+    regions = sub.add_parser('list-regions', help='список регионов')
+    regions.add_argument('--sort', choices=('name', 'latency'), default='name')
+    regions.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    regions.set_defaults(func=cmd_list_regions)
+
+    search = sub.add_parser('search', help='поиск по каталогу регионов и серверов')
+    search.add_argument('query', nargs='?', default='', help='строка поиска, допускает опечатки')
+    search.add_argument('--country')
+    search.add_argument('--city')
+    search.add_argument('--protocol')
+    search.add_argument('--tag', help='транспорт или защита: tcp, udp, tls, reality')
+    search.add_argument('--limit', type=int, default=20)
+    search.add_argument('--session', default=SESSION_FILE, help='файл сессии с закрепленными записями')
+    search.set_defaults(func=cmd_search)
+
+    sub.add_parser('vault', help='шифрование конфигурации: состояние и время разблокировки').set_defaults(func=cmd_vault)
+
+    validate = sub.add_parser('validate', help='проверить конфигурацию перед сохранением')
+    validate.add_argument('file', help="файл с конфигурацией или '-' для stdin")
+    validate.add_argument('--deadline', type=float, default=6.0)
+    validate.set_defaults(func=cmd_validate)
+
+    bench = sub.add_parser('bench', help='замеры производительности')
+    bench.add_argument('--suite', choices=('probe', 'accounting', 'bonding', 'compression'), default='probe',
+                       help='probe - задержка до серверов, accounting - накладные расходы учета трафика, '
+                            'bonding - один сервер против связки на заглушках, '
+                            'compression - сжатие текста и несжимаемых данных')
+    bench.add_argument('--rounds', type=int, default=5)
+    bench.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    bench.set_defaults(func=cmd_bench)
+
+    loadtest = sub.add_parser('loadtest', help='нагрузочный тест ретранслятора на loopback')
+    loadtest.add_argument('--requests', type=int, default=2000, help='число коротких запросов')
+    loadtest.add_argument('--concurrency', type=int, default=200, help='одновременных коротких запросов')
+    loadtest.add_argument('--response-size', type=int, default=4096, help='размер ответа на запрос, байт')
+    loadtest.add_argument('--bulk-streams', type=int, default=8, help='длинных передач')
+    loadtest.add_argument('--bulk-mb', type=int, default=64, help='всего мегабайт в длинных передачах')
+    loadtest.add_argument('--idle', type=int, default=1000, help='простаивающих соединений с keepalive')
+    loadtest.add_argument('--relay-port', type=int,
+                          help='нагружать уже запущенный ретранслятор; его upstream - 127.0.0.1:SINK_PORT')
+    loadtest.add_argument('--sink-port', type=int, default=0,
+                          help='порт приемника теста (обязателен с --relay-port)')
+    loadtest.add_argument('--output', help='сохранить отчет в JSON')
+    loadtest.add_argument('--compare', help='сравнить с сохраненным отчетом')
+    loadtest.set_defaults(func=cmd_loadtest)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (ControlError, VPNError, ValueError) as e:
+        print(f'Ошибка: {e}', file=sys.stderr)
+        return 1
@@ -0,0 +1,265 @@
+"""Адаптивное сжатие потоков между двумя ретрансляторами vpncore.
+
+Сжимающая сторона отправляет байт кодека, затем кадры: тип (RAW или DATA) и
+длина. Первые байты потока проверяются, и для уже сжатого содержимого (TLS,
+видео, архивы) поток идет несжатыми кадрами без затрат процессора.
+"""
+import struct
+import threading
+import time
+import zlib
+
+FRAME = struct.Struct('>BI')
+RAW = 0
+DATA = 1
+
+# Сколько первых байт потока пробовать сжать, чтобы решить
+SAMPLE_SIZE = 16 * 1024
+# Кадр больше этого - сжатый или после распаковки - считается ошибкой протокола.
+# Ретранслятор читает по 64 КБ, так что запас большой, а одна маленькая
+# "бомба" не заставит распаковщик выделить гигабайты
+MAX_FRAME = 1024 * 1024
+# Если пробное сжатие дает больше этой доли от исходного, сжатие выключается
+MAX_RATIO = 0.9
+# Проверка на лету: окно и порог, после которых поток переходит на RAW
+RECHECK_BYTES = 1024 * 1024
+RECHECK_RATIO = 0.95
+
+# Сигнатуры форматов, которые сжимать бесполезно
+COMPRESSED_MAGIC = (
+    b'\x16\x03',              # TLS handshake
+    b'\x17\x03',              # TLS application data
+    b'\x1f\x8b',              # gzip
+    b'PK\x03\x04',            # zip, apk
+    b'\x89PNG',
+    b'\xff\xd8\xff',          # jpeg
+    b'GIF8',
+    b'RIFF',                  # webp, avi
+    b'\x1a\x45\xdf\xa3',      # webm, mkv
+    b'(\xb5/\xfd',            # zstd
+    b'\x04"M\x18',            # lz4
+    b'7z\xbc\xaf',
+    b'BZh',
+)
+
+
+class ZlibCodec:
+    codec_id = 1
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        # Контекст инициализируется один раз, потоки получают его копию
+        self._template = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    def compressor(self):
+        ctx = self._template.copy()
+        return lambda data: ctx.compress(data) + ctx.flush(zlib.Z_SYNC_FLUSH)
+
+    def decompressor(self):
+        ctx = zlib.decompressobj(-15)
+
+        def decompress(payload):
+            data = ctx.decompress(payload, MAX_FRAME + 1)
+            if len(data) > MAX_FRAME or ctx.unconsumed_tail:
+                raise ValueError('Кадр zlib распаковывается больше допустимого')
+            return data
+        return decompress
+
+
+class ZstdCodec:
+    """zstd: каждый кадр - отдельный кадр zstd с размером данных в заголовке.
+
+    Потоковый распаковщик zstandard не умеет ограничивать вывод, а размер из
+    заголовка можно проверить до распаковки.
+    """
+    codec_id = 2
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        import zstandard
+        self._zstd = zstandard
+        self.level = level
+
+    def compressor(self):
+        # Контекст сжатия свой у каждого потока: ZstdCompressor не потокобезопасен
+        return self._zstd.ZstdCompressor(level=self.level).compress
+
+    def decompressor(self):
+        zstd = self._zstd
+        ctx = zstd.ZstdDecompressor()
+
+        def decompress(payload):
+            # Если размер указан, max_output_size не действует - проверяем сами
+            if zstd.frame_content_size(payload) > MAX_FRAME:
+                raise ValueError('Слишком большой кадр zstd')
+            return ctx.decompress(payload, max_output_size=MAX_FRAME, allow_extra_data=False)
+        return decompress
+
+
+class Lz4Codec:
+    """lz4 в блочном режиме: каждый кадр сжимается отдельно.
+
+    Потоковый lz4.frame не годится: flush() завершает кадр lz4, а
+    распаковщик отдает данные не целиком по каждому входному куску.
+    """
+    codec_id = 3
+    name = 'lz4'
+
+    def __init__(self):
+        import lz4.block
+        self._block = lz4.block
+
+    def compressor(self):
+        return self._block.compress
+
+    def decompressor(self):
+        block = self._block
+
+        def decompress(payload):
+            # Размер распакованного блока записан в первых 4 байтах
+            if int.from_bytes(payload[:4], 'little') > MAX_FRAME:
+                raise ValueError('Слишком большой блок lz4')
+            return block.decompress(payload)
+        return decompress
+
+
+CODEC_CLASSES = {cls.name: cls for cls in (ZlibCodec, ZstdCodec, Lz4Codec)}
+_codecs = {}
+_codecs_lock = threading.Lock()
+
+
+def available_codecs():
+    names = []
+    for name in CODEC_CLASSES:
+        try:
+            get_codec(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_codec(name='auto'):
+    """Общий экземпляр кодека; 'auto' - zstd, затем lz4, затем zlib"""
+    if name == 'auto':
+        for candidate in ('zstd', 'lz4'):
+            try:
+                return get_codec(candidate)
+            except ImportError:
+                continue
+        name = 'zlib'
+    with _codecs_lock:
+        codec = _codecs.get(name)
+        if codec is None:
+            codec = _codecs[name] = CODEC_CLASSES[name]()
+        return codec
+
+
+def codec_by_id(codec_id):
+    for name, cls in CODEC_CLASSES.items():
+        if cls.codec_id == codec_id:
+            return get_codec(name)
+    raise ValueError(f'Неизвестный кодек {codec_id}')
+
+
+def looks_compressed(sample):
+    """True, если начало потока похоже на уже сжатые или зашифрованные данные"""
+    if sample.startswith(COMPRESSED_MAGIC):
+        return True
+    # mp4/mov: 'ftyp' после 4 байт размера
+    return sample[4:8] == b'ftyp'
+
+
+def worth_compressing(sample):
+    if looks_compressed(sample):
+        return False
+    trial = zlib.compress(sample, 1)
+    return len(trial) < len(sample) * MAX_RATIO
+
+
+class CompressionStats:
+    """Общая статистика по всем потокам ретранслятора"""
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu = 0.0
+        self.flows_compressed = 0
+        self.flows_skipped = 0
+
+    def snapshot(self):
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            'cpu_ms': round(self.cpu * 1000, 1),
+            'flows_compressed': self.flows_compressed,
+            'flows_skipped': self.flows_skipped,
+        }
+
+
+class FlowEncoder:
+    """Кадрирует одно направление потока и решает, сжимать ли его.
+
+    Решение принимается по первому прочитанному блоку, без ожидания следующих,
+    чтобы не задерживать короткие интерактивные запросы.
+    """
+    def __init__(self, codec, stats):
+        self.codec = codec
+        self.stats = stats
+        self.compress = None
+        self.enabled = None
+        self._window_in = 0
+        self._window_out = 0
+
+    def preamble(self):
+        return bytes((self.codec.codec_id,))
+
+    def encode(self, data):
+        if self.enabled is None:
+            self.enabled = worth_compressing(data[:SAMPLE_SIZE])
+            if self.enabled:
+                self.stats.flows_compressed += 1
+                self.compress = self.codec.compressor()
+            else:
+                self.stats.flows_skipped += 1
+        if not self.enabled:
+            return FRAME.pack(RAW, len(data)) + data
+        start = time.thread_time()
+        try:
+            packed = self.compress(data)
+        except Exception as e:
+            raise ValueError(f'Ошибка сжатия {self.codec.name}: {e}') from e
+        self.stats.cpu += time.thread_time() - start
+        self.stats.bytes_in += len(data)
+        self.stats.bytes_out += len(packed)
+        self._window_in += len(data)
+        self._window_out += len(packed)
+        if self._window_in >= RECHECK_BYTES:
+            # Содержимое сменилось на несжимаемое (например, началось видео)
+            if self._window_out > self._window_in * RECHECK_RATIO:
+                self.enabled = False
+            self._window_in = self._window_out = 0
+        return FRAME.pack(DATA, len(packed)) + packed
+
+
+class FlowDecoder:
+    """Разбирает кадры одного направления"""
+    def __init__(self, codec_id, stats):
+        self.codec = codec_by_id(codec_id)
+        self.stats = stats
+        self.decompress = None
+
+    def decode(self, kind, payload):
+        if kind == RAW:
+            return payload
+        if kind != DATA:
+            raise ValueError(f'Неизвестный тип кадра {kind}')
+        if self.decompress is None:
+            self.decompress = self.codec.decompressor()
+        start = time.thread_time()
+        try:
+            data = self.decompress(payload)
+        except Exception as e:
+            raise ValueError(f'Поврежденный кадр {self.codec.name}: {e}') from e
+        self.stats.cpu += time.thread_time() - start
+        return data
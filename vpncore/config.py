@@ -0,0 +1,325 @@
+"""Хранение и разбор конфигурации VPN"""
+import base64
+import binascii
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from . import vault
+
+
+class ConfigError(ValueError):
+    """Конфигурация не распознана"""
+
+
+# transport: 'tcp' или 'udp'; security: 'tls', 'reality' или ''
+Endpoint = namedtuple('Endpoint', 'protocol host port transport security name')
+ParsedConfig = namedtuple('ParsedConfig', 'endpoints')
+
+URI_SCHEMES = {
+    'vless': 'tcp',
+    'vmess': 'tcp',
+    'trojan': 'tcp',
+    'ss': 'tcp',
+    'socks': 'tcp',
+    'socks5': 'tcp',
+    'http': 'tcp',
+    'https': 'tcp',
+    'hysteria2': 'udp',
+    'hy2': 'udp',
+    'tuic': 'udp',
+}
+
+
+class ConfigDatabase:
+    """Класс для работы с конфигурацией VPN.
+
+    Если доступен пакет cryptography, профили хранятся зашифрованными
+    (vault.Vault) и расшифровываются при первом обращении к каждому профилю.
+    Ключ начинает готовиться в фоне уже в конструкторе, поэтому запуск не
+    ждет KDF. Старый открытый формат читается и перешифровывается в фоне.
+    """
+    DEFAULT_PROFILE = 'default'
+
+    def __init__(self, filepath, encrypt=True, keystore=None):
+        self.filepath = filepath
+        self._lock = threading.RLock()
+        self._plain = {}
+        self._decrypting = set()
+        self.error = ''
+        self.config = self.load_config()
+        self.vault = None
+        if encrypt and vault.available():
+            kdf = self.config.get('kdf') or {}
+            salt = vault.b64decode(kdf['salt']) if kdf.get('salt') else None
+            params = {k: kdf[k] for k in ('n', 'r', 'p') if k in kdf} or None
+            keystore = keystore or vault.KeyStore(os.path.dirname(os.path.abspath(filepath)))
+            self.vault = vault.Vault(keystore, salt, params)
+            self.vault.unlock_async()
+            if self.config.get('config'):
+                threading.Thread(target=self.migrate, daemon=True).start()
+
+    @property
+    def encrypted(self):
+        return 'profiles' in self.config
+
+    def load_config(self):
+        """Загружает конфигурацию из файла (без расшифровки)"""
+        if os.path.exists(self.filepath):
+            try:
+                with open(self.filepath, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except:
+                return {}
+        return {}
+
+    def _write(self, data):
+        tmp_path = self.filepath + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.filepath)
+
+    def save_config(self, config_string, profile=None):
+        """Сохраняет конфигурацию в файл (в профиль profile, по умолчанию активный)"""
+        try:
+            with self._lock:
+                created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                if self.vault is None:
+                    self.config = {'config': config_string, 'created_at': created_at}
+                    self._write(self.config)
+                    return True
+                profile = profile or self.active_profile()
+                data = {
+                    'version': 2,
+                    'kdf': self.vault.kdf_info(),
+                    'active': self.config.get('active', profile),
+                    'profiles': dict(self.config.get('profiles', {})),
+                }
+                record = self.vault.encrypt(config_string, profile)
+                record['created_at'] = created_at
+                data['profiles'][profile] = record
+                self._write(data)
+                self.config = data
+                self._plain[profile] = config_string
+                return True
+        except:
+            return False
+
+    def migrate(self):
+        """Перешифровывает файл старого формата, когда ключ готов"""
+        with self._lock:
+            plain = self.config.get('config')
+            if not plain or self.encrypted or self.vault is None:
+                return False
+            return self.save_config(plain, self.DEFAULT_PROFILE)
+
+    def active_profile(self):
+        return self.config.get('active', self.DEFAULT_PROFILE)
+
+    def profile_names(self):
+        if self.encrypted:
+            return sorted(self.config['profiles'])
+        return [self.DEFAULT_PROFILE] if self.config.get('config') else []
+
+    def set_active(self, profile):
+        with self._lock:
+            if self.encrypted and profile in self.config['profiles']:
+                data = dict(self.config, active=profile)
+                self._write(data)
+                self.config = data
+                return True
+            return False
+
+    def has_config(self):
+        """Проверяет, есть ли сохраненная конфигурация"""
+        if self.encrypted:
+            return self.active_profile() in self.config['profiles']
+        return 'config' in self.config and self.config['config']
+
+    def get_config(self, profile=None, block=True):
+        """Получает сохраненную конфигурацию; профиль расшифровывается при первом обращении.
+
+        block=False - для UI-потока: пока ключ не готов, возвращает None и
+        расшифровывает профиль в фоновом потоке, а не ждет KDF.
+        """
+        if not self.encrypted:
+            return self.config.get('config', '')
+        profile = profile or self.active_profile()
+        plain = self._plain.get(profile)
+        if plain is not None:
+            return plain
+        record = self.config['profiles'].get(profile)
+        if record is None:
+            return ''
+        if self.vault is None:
+            self.error = 'Конфигурация зашифрована, а шифрование недоступно (нужен пакет cryptography)'
+            return ''
+        if not block and not self.vault.ready:
+            self._decrypt_async(profile)
+            return None
+        try:
+            plain = self.vault.decrypt(record, profile)
+        except vault.VaultError as e:
+            self.error = str(e)
+            return ''
+        self._plain[profile] = plain
+        return plain
+
+    def _decrypt_async(self, profile):
+        with self._lock:
+            if profile in self._decrypting:
+                return
+            self._decrypting.add(profile)
+
+        def worker():
+            try:
+                self.get_config(profile)
+            finally:
+                with self._lock:
+                    self._decrypting.discard(profile)
+        threading.Thread(target=worker, daemon=True).start()
+
+
+def _b64decode(data):
+    """Декодирует base64 с любым вариантом алфавита и без паддинга"""
+    data = data.strip().replace('-', '+').replace('_', '/')
+    data += '=' * (-len(data) % 4)
+    return base64.b64decode(data, validate=True).decode('utf-8')
+
+
+def _split_host_port(value):
+    """Разбирает host:port, включая [ipv6]:port"""
+    host, sep, port = value.strip().rpartition(':')
+    if not sep or not host:
+        raise ConfigError(f'Нет порта в адресе: {value}')
+    host = host.strip('[]')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ConfigError(f'Неверный порт: {value}')
+    return host, port
+
+
+def _check_port(port):
+    if not 0 < port < 65536:
+        raise ConfigError(f'Порт вне диапазона: {port}')
+    return port
+
+
+def _parse_vmess(body, name):
+    try:
+        data = json.loads(_b64decode(body))
+    except (ValueError, binascii.Error):
+        raise ConfigError('Неверный vmess')
+    host = data.get('add')
+    if not host:
+        raise ConfigError('В vmess нет адреса')
+    try:
+        port = _check_port(int(data.get('port', 0)))
+    except (TypeError, ValueError):
+        raise ConfigError('Неверный порт vmess')
+    security = 'tls' if data.get('tls') == 'tls' else ''
+    return Endpoint('vmess', host, port, 'tcp', security, data.get('ps') or name)
+
+
+def _parse_shadowsocks(body, name):
+    # SIP002: ss://userinfo@host:port или legacy ss://base64(method:pass@host:port)
+    if '@' not in body:
+        try:
+            body = _b64decode(body.split('?', 1)[0])
+        except (ValueError, binascii.Error):
+            raise ConfigError('Неверный ss')
+    hostport = body.rpartition('@')[2].split('?', 1)[0].split('/', 1)[0]
+    host, port = _split_host_port(hostport)
+    return Endpoint('ss', host, _check_port(port), 'tcp', '', name)
+
+
+def parse_uri(line):
+    """Разбирает одну ссылку вида scheme://...#name"""
+    scheme, _, rest = line.partition('://')
+    scheme = scheme.lower()
+    if scheme not in URI_SCHEMES:
+        raise ConfigError(f'Неизвестный протокол: {scheme}')
+    rest, _, fragment = rest.partition('#')
+    name = unquote(fragment).strip()
+    if scheme == 'vmess':
+        return _parse_vmess(rest, name)
+    if scheme == 'ss':
+        return _parse_shadowsocks(rest, name)
+    parts = urlsplit(f'{scheme}://{rest}')
+    try:
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        raise ConfigError(f'Неверный адрес: {line}')
+    if not host or not port:
+        raise ConfigError(f'Нет адреса или порта: {line}')
+    query = parse_qs(parts.query)
+    security = query.get('security', [''])[0]
+    if scheme in ('trojan', 'https', 'hysteria2', 'hy2', 'tuic') and not security:
+        security = 'tls'
+    return Endpoint(scheme, host, _check_port(port), URI_SCHEMES[scheme], security, name)
+
+
+def _parse_wireguard(text):
+    endpoints = []
+    name = ''
+    for raw in text.splitlines():
+        line = raw.strip()
+        if line.startswith('#'):
+            name = line.lstrip('#').strip()
+            continue
+        key, sep, value = line.partition('=')
+        if sep and key.strip().lower() == 'endpoint':
+            host, port = _split_host_port(value)
+            endpoints.append(Endpoint('wireguard', host, _check_port(port), 'udp', '', name))
+    if not endpoints:
+        raise ConfigError('В конфигурации WireGuard нет Endpoint')
+    return endpoints
+
+
+def _walk_json(node, found):
+    if isinstance(node, dict):
+        host = node.get('address') or node.get('server')
+        port = node.get('port') or node.get('server_port')
+        if isinstance(host, str) and isinstance(port, int):
+            protocol = node.get('protocol') or node.get('type') or 'json'
+            tls = node.get('tls')
+            security = 'tls' if tls and (not isinstance(tls, dict) or tls.get('enabled')) else ''
+            found.append(Endpoint(protocol, host, _check_port(port), 'tcp', security, node.get('tag', '')))
+        for value in node.values():
+            _walk_json(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            _walk_json(value, found)
+
+
+def parse_config(text):
+    """Разбирает конфигурацию и возвращает ParsedConfig со списком серверов"""
+    text = (text or '').strip()
+    if not text:
+        raise ConfigError('Пустая конфигурация')
+    if '[Interface]' in text or '[Peer]' in text:
+        return ParsedConfig(_parse_wireguard(text))
+    if text.startswith(('{', '[')):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            raise ConfigError('Неверный JSON')
+        endpoints = []
+        _walk_json(data, endpoints)
+        if not endpoints:
+            raise ConfigError('В JSON нет серверов')
+        return ParsedConfig(endpoints)
+    if '://' not in text:
+        # Подписка целиком в base64
+        try:
+            text = _b64decode(text)
+        except (ValueError, binascii.Error):
+            raise ConfigError('Формат конфигурации не распознан')
+        if '://' not in text:
+            raise ConfigError('Формат конфигурации не распознан')
+    endpoints = [parse_uri(line.strip()) for line in text.splitlines() if line.strip()]
+    return ParsedConfig(endpoints)
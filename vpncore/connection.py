@@ -0,0 +1,193 @@
+"""Менеджер подключения: выбор сервера и состояние VPN"""
+import threading
+import time
+
+from .config import parse_config
+from .probe import DEFAULT_TIMEOUT, probe_endpoint, probe_many, rank_key
+from .regions import DEFAULT_REGION, endpoints_for_region
+
+
+class VPNError(Exception):
+    """Ошибка подключения"""
+
+
+class ConnectionManager:
+    """Хранит состояние подключения и выбирает лучший сервер региона"""
+    def __init__(self, config_db, region=DEFAULT_REGION, health=None, accounting=None, relay_port=None,
+                 bonding=0, compression=None):
+        self.config_db = config_db
+        self.health = health
+        self.accounting = accounting
+        self.relay_port = relay_port
+        # Сколько лучших серверов объединять для массовых передач; 0 или 1 - один сервер
+        self.bonding = bonding
+        # Кодек сжатия потоков; работает, только если сервер - ретранслятор vpncore (команда peer)
+        self.compression = compression
+        self.relay = None
+        self.region = region
+        # Сервер, выбранный вручную в каталоге; None - лучший сервер региона
+        self.preferred = None
+        self.connected = False
+        self.endpoint = None
+        self.address = None
+        self.latency = None
+        self.connected_at = None
+        self.last_error = ''
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._parsed = (None, None)
+
+    def add_listener(self, callback):
+        """Подписывает callback(manager) на изменения состояния"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self):
+        for callback in list(self._listeners):
+            callback(self)
+
+    def endpoints(self, block=True):
+        """Серверы из сохраненной конфигурации (разбор кэшируется).
+
+        block=False - None, пока конфигурация расшифровывается (см. ConfigDatabase.get_config).
+        """
+        raw = self.config_db.get_config(block=block)
+        if raw is None:
+            return None
+        cached_raw, parsed = self._parsed
+        if raw != cached_raw:
+            parsed = parse_config(raw)
+            self._parsed = (raw, parsed)
+        return parsed.endpoints
+
+    def region_endpoints(self, region=None):
+        """Серверы региона; если в названиях регион не указан, то все"""
+        endpoints = self.endpoints()
+        return endpoints_for_region(endpoints, region or self.region) or endpoints
+
+    def set_region(self, region, server=None):
+        with self._lock:
+            self.region = region
+            self.preferred = server
+        self._notify()
+
+    def connect(self, region=None, timeout=DEFAULT_TIMEOUT):
+        """Подключается к самому быстрому доступному серверу региона"""
+        with self._lock:
+            region = region or self.region
+            try:
+                candidates = self.region_endpoints(region)
+            except ValueError as e:
+                self.last_error = str(e)
+                raise VPNError(self.last_error)
+            preferred = self.preferred if region == self.region else None
+            if self.health is not None:
+                # Серверы с разомкнутым circuit breaker пропускаем, если есть другие
+                candidates = [ep for ep in candidates if self.health.is_available(ep)] or candidates
+            # Сервер, выбранный в каталоге, проверяется всегда, даже если его имя
+            # не относится к региону или монитор считает его недоступным
+            if preferred is not None and preferred not in candidates:
+                candidates = [preferred] + candidates
+            # Выбранный вручную сервер первый, если он доступен
+            results = sorted(probe_many(candidates, timeout),
+                             key=lambda r: (not (r.ok and r.endpoint == preferred), rank_key(r)))
+            if not results or not results[0].ok:
+                self.last_error = results[0].error if results else 'Нет серверов'
+                raise VPNError(self.last_error)
+            best = results[0]
+            self._set_connected(best, region, results)
+        self._notify()
+        return best
+
+    def _set_connected(self, result, region, results=None):
+        self._start_relay(result.endpoint, result.address, results)
+        self.region = region
+        self.endpoint = result.endpoint
+        self.address = result.address
+        self.latency = result.latency
+        self.connected = True
+        self.connected_at = time.time()
+        self.last_error = ''
+
+    def reconnect(self, server, timeout=DEFAULT_TIMEOUT):
+        """Переподключается к серверу прошлой сессии по известному адресу, иначе обычный connect"""
+        try:
+            endpoints = self.endpoints() if server else []
+        except ValueError:
+            endpoints = []
+        for endpoint in endpoints:
+            if (endpoint.protocol, endpoint.host, endpoint.port) != (server['protocol'], server['host'], server['port']):
+                continue
+            # Адрес уже известен, поэтому DNS пропускаем
+            target = endpoint._replace(host=server['address']) if server.get('address') else endpoint
+            result = probe_endpoint(target, timeout)
+            if result.ok:
+                with self._lock:
+                    try:
+                        self._set_connected(result._replace(endpoint=endpoint), self.region)
+                    except VPNError:
+                        break
+                self._notify()
+                return True
+            break
+        try:
+            self.connect(timeout=timeout)
+        except VPNError:
+            return False
+        return True
+
+    def _start_relay(self, endpoint, address=None, results=None):
+        """Перезапускает локальный ретранслятор на выбранный сервер (или несколько в режиме bonding)"""
+        if self.relay_port is None:
+            return
+        from .bonding import BondedRelay, select_paths
+        from .relay import Relay, RelayThread
+        self._stop_relay()
+        options = {'port': self.relay_port, 'accounting': self.accounting}
+        if self.compression:
+            options.update(compression='compress', codec=self.compression)
+        paths = select_paths(results, self.bonding, endpoint) if results and self.bonding > 1 else []
+        if len(paths) > 1:
+            relay = RelayThread(BondedRelay(paths, **options))
+        else:
+            relay = RelayThread(Relay((address or endpoint.host, endpoint.port), **options))
+        try:
+            relay.start()
+        except OSError as e:
+            self.last_error = f'relay: {e}'
+            raise VPNError(self.last_error)
+        self.relay = relay
+
+    def _stop_relay(self):
+        if self.relay is not None:
+            self.relay.stop()
+            self.relay = None
+
+    def disconnect(self):
+        with self._lock:
+            self._stop_relay()
+            self.connected = False
+            self.endpoint = None
+            self.address = None
+            self.latency = None
+            self.connected_at = None
+        self._notify()
+
+    def status(self):
+        """Состояние в виде словаря для CLI и UI"""
+        with self._lock:
+            endpoint = self.endpoint
+            return {
+                'connected': self.connected,
+                'region': self.region,
+                'server': f'{endpoint.host}:{endpoint.port}' if endpoint else None,
+                'protocol': endpoint.protocol if endpoint else None,
+                'address': self.address,
+                'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+                'uptime': round(time.time() - self.connected_at) if self.connected_at else 0,
+                'error': self.last_error,
+                'relay': self.relay.relay.stats() if self.relay else None,
+            }
@@ -0,0 +1,90 @@
+"""Управляющий сокет демона: JSON по строке на запрос"""
+import json
+import socket
+import socketserver
+import threading
+
+CONTROL_HOST = '127.0.0.1'
+CONTROL_PORT = 47801
+DEFAULT_RELAY_PORT = 10808
+
+
+class ControlError(Exception):
+    """Демон недоступен или вернул ошибку"""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                result = self.server.dispatch(request.get('cmd'), request.get('args') or {})
+                response = {'ok': True, 'result': result}
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    """Принимает команды для ConnectionManager"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, manager, host=CONTROL_HOST, port=CONTROL_PORT, scheduler=None):
+        super().__init__((host, port), _Handler)
+        self.manager = manager
+        self.scheduler = scheduler
+
+    def dispatch(self, cmd, args):
+        handler = getattr(self, f'cmd_{cmd}', None)
+        if handler is None:
+            raise ControlError(f'Неизвестная команда: {cmd}')
+        return handler(**args)
+
+    def cmd_status(self):
+        return self.manager.status()
+
+    def cmd_connect(self, region=None):
+        self.manager.connect(region)
+        return self.manager.status()
+
+    def cmd_health(self):
+        if self.manager.health is None:
+            return []
+        return self.manager.health.snapshot()
+
+    def cmd_traffic(self):
+        if self.manager.accounting is None:
+            return []
+        return self.manager.accounting.breakdown()
+
+    def cmd_tasks(self):
+        if self.scheduler is None:
+            return []
+        return self.scheduler.stats()
+
+    def cmd_disconnect(self):
+        self.manager.disconnect()
+        return self.manager.status()
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def send_command(cmd, host=CONTROL_HOST, port=CONTROL_PORT, timeout=30.0, **args):
+    """Отправляет команду демону и возвращает результат"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.sendall(json.dumps({'cmd': cmd, 'args': args}).encode('utf-8') + b'\n')
+            line = sock.makefile('rb').readline()
+    except OSError as e:
+        raise ControlError(f'Демон не запущен ({e})')
+    if not line:
+        raise ControlError('Демон закрыл соединение')
+    response = json.loads(line)
+    if not response.get('ok'):
+        raise ControlError(response.get('error', ''))
+    return response.get('result')
@@ -0,0 +1,277 @@
+"""Фоновый мониторинг серверов с адаптивным расписанием и circuit breaker"""
+import random
+import threading
+import time
+
+from .probe import DEFAULT_TIMEOUT, ProbeResult, probe_endpoint
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class TokenBucket:
+    """Бюджет проверок: rate токенов в секунду, не больше capacity за раз"""
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, amount=1):
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, amount=1):
+        """Сколько секунд ждать, пока накопится amount токенов"""
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+class ServerHealth:
+    """Состояние одного сервера"""
+    def __init__(self, endpoint, now):
+        self.endpoint = endpoint
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.streak = 0
+        self.latency = None
+        self.last_error = ''
+        self.last_probe = None
+        self.next_probe = now
+        self.in_flight = False
+
+    @property
+    def healthy(self):
+        return self.state == CLOSED and self.last_probe is not None
+
+    @property
+    def known(self):
+        return self.last_probe is not None
+
+    @property
+    def score(self):
+        """Оценка 0..1 для сортировки: 0 у недоступных, выше у быстрых"""
+        if not self.healthy:
+            return 0.0
+        if self.latency is None:
+            return 0.5
+        return 1.0 / (1.0 + self.latency * 10)
+
+
+class HealthMonitor:
+    """Проверяет серверы по расписанию, чаще выбранные и избранные, реже простаивающие"""
+    def __init__(self, probe=probe_endpoint, timeout=DEFAULT_TIMEOUT,
+                 active_interval=15.0, idle_interval=60.0, max_interval=900.0,
+                 failure_threshold=3, open_timeout=30.0, rate=0.5, burst=3,
+                 workers=4, clock=time.monotonic):
+        self.probe = probe
+        self.timeout = timeout
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.max_interval = max_interval
+        self.failure_threshold = failure_threshold
+        self.open_timeout = open_timeout
+        self.workers = workers
+        self.clock = clock
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.servers = {}
+        self.priority = set()
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._pool = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def add_listener(self, callback):
+        """callback(server_health) вызывается из рабочего потока после каждой проверки"""
+        self._listeners.append(callback)
+
+    def set_endpoints(self, endpoints):
+        """Обновляет список серверов, сохраняя накопленную статистику"""
+        endpoints = set(endpoints)
+        with self._lock:
+            if endpoints == set(self.servers):
+                return
+            now = self.clock()
+            for endpoint in list(self.servers):
+                if endpoint not in endpoints:
+                    del self.servers[endpoint]
+            for endpoint in endpoints:
+                if endpoint not in self.servers:
+                    self.servers[endpoint] = ServerHealth(endpoint, now)
+
+    def set_priority(self, endpoints):
+        """Выбранные и избранные серверы проверяются часто и без ожидания"""
+        with self._lock:
+            old = self.priority
+            self.priority = set(endpoints)
+            now = self.clock()
+            for endpoint in self.priority - old:
+                health = self.servers.get(endpoint)
+                if health and health.state == CLOSED:
+                    health.streak = 0
+                    health.next_probe = min(health.next_probe, now)
+
+    def get(self, endpoint):
+        return self.servers.get(endpoint)
+
+    def is_available(self, endpoint):
+        """False только для серверов с разомкнутым circuit breaker"""
+        health = self.servers.get(endpoint)
+        return health is None or health.state == CLOSED
+
+    def region_health(self, endpoints):
+        """True/False для группы серверов или None, если данных пока нет"""
+        known = [self.servers[ep] for ep in endpoints if ep in self.servers and self.servers[ep].known]
+        if not known:
+            return None
+        return any(h.healthy for h in known)
+
+    def _jitter(self, interval):
+        return interval * random.uniform(0.9, 1.1)
+
+    def _interval(self, health):
+        if health.endpoint in self.priority:
+            return self.active_interval
+        # Простаивающие серверы: интервал растет вдвое после каждой успешной проверки
+        return min(self.max_interval, self.idle_interval * (2 ** min(health.streak, 16)))
+
+    def _record(self, health, result):
+        now = self.clock()
+        with self._lock:
+            health.in_flight = False
+            health.last_probe = now
+            if result.ok:
+                health.latency = result.latency if health.latency is None or result.latency is None \
+                    else health.latency * 0.7 + result.latency * 0.3
+                health.state = CLOSED
+                health.failures = 0
+                health.opens = 0
+                health.last_error = ''
+                interval = self._interval(health)
+                health.streak += 1
+            else:
+                health.failures += 1
+                health.streak = 0
+                health.last_error = result.error
+                if health.state == HALF_OPEN or health.failures >= self.failure_threshold:
+                    health.state = OPEN
+                    health.opens += 1
+                    interval = min(self.max_interval, self.open_timeout * (2 ** (health.opens - 1)))
+                else:
+                    interval = min(self._interval(health), self.active_interval)
+            health.next_probe = now + self._jitter(interval)
+        for callback in list(self._listeners):
+            callback(health)
+
+    def _run_probe(self, health):
+        try:
+            result = self.probe(health.endpoint, self.timeout)
+        except Exception as e:
+            result = ProbeResult(health.endpoint, False, None, None, str(e))
+        self._record(health, result)
+
+    def due(self, now=None):
+        """Серверы, которые пора проверить: сначала приоритетные, затем самые просроченные"""
+        now = self.clock() if now is None else now
+        with self._lock:
+            due = [h for h in self.servers.values() if not h.in_flight and h.next_probe <= now]
+        due.sort(key=lambda h: (h.endpoint not in self.priority, h.next_probe))
+        return due
+
+    def run_due(self):
+        """Запускает проверки, на которые хватает бюджета; не блокирует"""
+        started = 0
+        for health in self.due():
+            if not self.bucket.try_take():
+                break
+            with self._lock:
+                if health.state == OPEN:
+                    health.state = HALF_OPEN
+                health.in_flight = True
+            self._executor().submit(self._run_probe, health)
+            started += 1
+        return started
+
+    def next_due(self):
+        """Через сколько секунд появится следующая проверка"""
+        with self._lock:
+            pending = [h.next_probe for h in self.servers.values() if not h.in_flight]
+        if not pending:
+            return self.idle_interval
+        delay = max(0.0, min(pending) - self.clock())
+        return max(delay, self.bucket.wait_time())
+
+    def _executor(self):
+        if self._pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def start(self):
+        """Собственный фоновый поток, для демона без цикла событий Kivy"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_due()
+            self._stop.wait(min(max(self.next_due(), 0.1), 5.0))
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def export_scores(self):
+        """Задержка и доступность проверенных серверов для сохранения между запусками"""
+        with self._lock:
+            return {
+                f'{h.endpoint.host}:{h.endpoint.port}': {'latency': h.latency, 'healthy': h.healthy}
+                for h in self.servers.values() if h.known
+            }
+
+    def restore_scores(self, scores):
+        """Восстанавливает оценки; недоступные серверы будут перепроверены первыми"""
+        now = self.clock()
+        with self._lock:
+            for health in self.servers.values():
+                score = scores.get(f'{health.endpoint.host}:{health.endpoint.port}')
+                if not score or health.known:
+                    continue
+                health.latency = score.get('latency')
+                health.last_probe = now
+                if not score.get('healthy', True):
+                    health.state = OPEN
+                    health.failures = self.failure_threshold
+                    health.next_probe = now
+
+    def snapshot(self):
+        """Состояние всех серверов для CLI и UI"""
+        with self._lock:
+            return [{
+                'server': f'{h.endpoint.host}:{h.endpoint.port}',
+                'name': h.endpoint.name,
+                'state': h.state,
+                'healthy': h.healthy,
+                'latency_ms': round(h.latency * 1000, 1) if h.latency is not None else None,
+                'next_probe_in': round(max(0.0, h.next_probe - self.clock()), 1),
+                'error': h.last_error,
+            } for h in self.servers.values()]
@@ -0,0 +1,326 @@
+"""Нагрузочный тест ретранслятора: много одновременных клиентов через loopback"""
+import asyncio
+import json
+import math
+import platform as _platform
+import threading
+import time
+import tracemalloc
+
+from .relay import Relay, RelayThread
+
+CHUNK = 64 * 1024
+
+
+def percentile(values, fraction):
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def latency_summary(samples):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'p50_ms': _ms(percentile(samples, 0.50)),
+        'p99_ms': _ms(percentile(samples, 0.99)),
+        'p999_ms': _ms(percentile(samples, 0.999)),
+        'max_ms': _ms(samples[-1] if samples else None),
+    }
+
+
+def _ms(value):
+    return round(value * 1000, 3) if value is not None else None
+
+
+def raise_fd_limit():
+    """Поднимает мягкий лимит открытых файлов до жесткого (на каждый поток 4 сокета)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+async def start_sink(host='127.0.0.1', port=0):
+    """Сервер-приемник с простым протоколом по первой строке:
+
+    REQ <n>  - ответить n байт и закрыть (короткий HTTP-подобный запрос);
+    BULK     - читать до EOF и ответить OK;
+    IDLE     - держать соединение, отвечая эхом на каждую строку (keepalive).
+    """
+    handlers = set()
+
+    async def handle(reader, writer):
+        handlers.add(asyncio.current_task())
+        try:
+            header = await reader.readline()
+            kind, _, arg = header.decode().strip().partition(' ')
+            if kind == 'REQ':
+                writer.write(b'x' * int(arg or 0))
+            elif kind == 'BULK':
+                while await reader.read(CHUNK):
+                    pass
+                writer.write(b'OK')
+            elif kind == 'IDLE':
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    writer.write(line)
+                    await writer.drain()
+            await writer.drain()
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            writer.close()
+            handlers.discard(asyncio.current_task())
+    server = await asyncio.start_server(handle, host, port, backlog=4096)
+    server.handlers = handlers
+    return server
+
+
+async def lag_monitor(samples, stop, interval=0.01):
+    """Записывает опоздание пробуждения цикла событий относительно interval.
+
+    stop - threading.Event, так как монитор работает в цикле другого потока.
+    """
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+class LoadTest:
+    """Смесь коротких запросов, длинных передач и простаивающих соединений.
+
+    Ретранслятор работает в собственном потоке (как в демоне), клиенты и
+    приемник - в цикле событий теста. Если задан relay_port, нагрузка идет на
+    уже запущенный ретранслятор, и память/задержка его цикла не измеряются;
+    его upstream должен вести на приемник, поэтому приемник тогда слушает
+    заданный sink_port.
+    """
+    def __init__(self, requests=2000, concurrency=200, response_size=4096, bulk_streams=8,
+                 bulk_megabytes=16, idle=1000, ping_interval=1.0, relay_port=None, connect_timeout=10.0,
+                 sink_port=0):
+        self.requests = requests
+        self.concurrency = concurrency
+        self.response_size = response_size
+        self.bulk_streams = bulk_streams
+        self.bulk_megabytes = bulk_megabytes
+        self.idle = idle
+        self.ping_interval = ping_interval
+        self.relay_port = relay_port
+        self.sink_port = sink_port
+        self.connect_timeout = connect_timeout
+        self.request_latency = []
+        self.ping_latency = []
+        self.loop_lag = []
+        self.errors = 0
+        self.bytes = 0
+
+    async def _open(self, port):
+        return await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), self.connect_timeout)
+
+    async def short_request(self, port):
+        start = time.perf_counter()
+        try:
+            reader, writer = await self._open(port)
+            writer.write(f'REQ {self.response_size}\n'.encode())
+            await writer.drain()
+            data = await reader.read()
+            writer.close()
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            self.errors += 1
+            return
+        if len(data) != self.response_size:
+            self.errors += 1
+            return
+        self.bytes += len(data)
+        self.request_latency.append(time.perf_counter() - start)
+
+    async def short_requests(self, port):
+        queue = iter(range(self.requests))
+
+        async def worker():
+            for _ in queue:
+                await self.short_request(port)
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+
+    async def bulk_stream(self, port):
+        payload = b'x' * CHUNK
+        total = self.bulk_megabytes * 1024 * 1024 // max(1, self.bulk_streams)
+        try:
+            reader, writer = await self._open(port)
+            writer.write(b'BULK\n')
+            sent = 0
+            while sent < total:
+                writer.write(payload)
+                await writer.drain()
+                sent += len(payload)
+            writer.write_eof()
+            reply = await reader.read()
+            writer.close()
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            self.errors += 1
+            return 0
+        if reply != b'OK':
+            self.errors += 1
+            return 0
+        self.bytes += sent
+        return sent
+
+    async def open_idle(self, port):
+        try:
+            reader, writer = await self._open(port)
+            writer.write(b'IDLE\n')
+            await writer.drain()
+            return reader, writer
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            self.errors += 1
+            return None
+
+    async def keepalive(self, conn, stop):
+        reader, writer = conn
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                writer.write(b'ping\n')
+                await writer.drain()
+                if not await reader.readline():
+                    self.errors += 1
+                    return
+                self.ping_latency.append(time.perf_counter() - start)
+                try:
+                    await asyncio.wait_for(stop.wait(), self.ping_interval)
+                except asyncio.TimeoutError:
+                    pass
+        except (ConnectionError, OSError):
+            self.errors += 1
+
+    async def run(self):
+        sink = await start_sink(port=self.sink_port)
+        sink_port = sink.sockets[0].getsockname()[1]
+        relay_thread = None
+        port = self.relay_port
+        if port is None:
+            relay_thread = RelayThread(Relay(('127.0.0.1', sink_port), port=0))
+            port = relay_thread.start()
+        stop = asyncio.Event()
+        relay_stop = threading.Event()
+        monitor = None
+        if relay_thread is not None:
+            monitor = asyncio.run_coroutine_threadsafe(
+                lag_monitor(self.loop_lag, relay_stop), relay_thread.loop)
+
+        # Прирост кучи Python на одно простаивающее соединение. tracemalloc не делит
+        # память по потокам, поэтому это сумма всех трех сторон в одном процессе:
+        # клиента, ретранслятора и приемника (отсюда и имя метрики в отчете)
+        memory_per_connection = None
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        idle = [conn for conn in await asyncio.gather(*[self.open_idle(port) for _ in range(self.idle)]) if conn]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        if idle and relay_thread is not None:
+            memory_per_connection = (after - before) / len(idle)
+        keepalives = [asyncio.ensure_future(self.keepalive(conn, stop)) for conn in idle]
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            self.short_requests(port),
+            *[self.bulk_stream(port) for _ in range(self.bulk_streams)],
+        )
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        await asyncio.gather(*keepalives)
+        for _, writer in idle:
+            writer.close()
+        relay_stats = None
+        if relay_thread is not None:
+            relay_stop.set()
+            monitor.result(5)
+            relay_stats = relay_thread.relay.stats()
+            relay_thread.stop()
+        sink.close()
+        if sink.handlers:
+            await asyncio.wait(list(sink.handlers), timeout=5.0)
+        return self.report(elapsed, len(idle), memory_per_connection, relay_stats)
+
+    def report(self, elapsed, idle_open, memory_per_connection, relay_stats):
+        lag = sorted(self.loop_lag)
+        return {
+            'python': _platform.python_version(),
+            'timestamp': round(time.time()),
+            'params': {
+                'requests': self.requests,
+                'concurrency': self.concurrency,
+                'response_size': self.response_size,
+                'bulk_streams': self.bulk_streams,
+                'bulk_megabytes': self.bulk_megabytes,
+                'idle': self.idle,
+            },
+            'elapsed_s': round(elapsed, 3),
+            'throughput_mb_s': round(self.bytes / elapsed / (1024 * 1024), 2) if elapsed else None,
+            'requests_per_s': round(len(self.request_latency) / elapsed, 1) if elapsed else None,
+            'errors': self.errors,
+            'idle_open': idle_open,
+            'request_latency': latency_summary(self.request_latency),
+            'keepalive_latency': latency_summary(self.ping_latency),
+            'heap_per_connection_all_sides_kb': round(memory_per_connection / 1024, 2)
+            if memory_per_connection is not None else None,
+            'loop_lag': {
+                'p99_ms': _ms(percentile(lag, 0.99)),
+                'max_ms': _ms(lag[-1] if lag else None),
+            } if lag else None,
+            'relay': relay_stats,
+        }
+
+
+def run_loadtest(**kwargs):
+    raise_fd_limit()
+    return asyncio.run(LoadTest(**kwargs).run())
+
+
+def _flatten(data, prefix=''):
+    flat = {}
+    for key, value in data.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare_reports(baseline, current):
+    """Изменение числовых метрик относительно прошлого отчета, в процентах"""
+    old = _flatten(baseline)
+    new = _flatten(current)
+    rows = []
+    for key in sorted(new):
+        if key in old and not key.startswith(('params.', 'timestamp', 'relay.port')):
+            change = round((new[key] - old[key]) / old[key] * 100, 1) if old[key] else None
+            rows.append({'metric': key, 'baseline': old[key], 'current': new[key], 'change_percent': change})
+    return rows
+
+
+def load_report(filepath):
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_report(report, filepath):
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,42 @@
+"""Пути к данным приложения без зависимости от Kivy"""
+import os
+import sys
+
+
+def detect_platform():
+    """Определяет платформу так же, как kivy.utils.platform, но без импорта Kivy"""
+    if 'ANDROID_ARGUMENT' in os.environ or 'P4A_BOOTSTRAP' in os.environ:
+        return 'android'
+    if os.environ.get('KIVY_BUILD', '') == 'ios':
+        return 'ios'
+    if sys.platform in ('win32', 'cygwin'):
+        return 'win'
+    if sys.platform == 'darwin':
+        return 'macosx'
+    if sys.platform.startswith(('linux', 'freebsd')):
+        return 'linux'
+    return 'unknown'
+
+
+platform = detect_platform()
+
+
+def get_data_dir():
+    """Получает правильную директорию для данных в зависимости от платформы"""
+    override = os.environ.get('IKISKY_DATA_DIR')
+    if override:
+        return override
+    if platform == 'android':
+        from android.storage import app_storage_path
+        return app_storage_path()
+    else:
+        return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def data_path(*parts):
+    """Путь внутри директории данных"""
+    return os.path.join(get_data_dir(), *parts)
+
+
+CONFIG_FILE = data_path("vpn_config.json")
+SESSION_FILE = data_path("session.json")
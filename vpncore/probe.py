@@ -0,0 +1,110 @@
+"""Проверка доступности серверов"""
+import socket
+import time
+from collections import namedtuple
+
+# latency в секундах или None, если замерить не удалось
+ProbeResult = namedtuple('ProbeResult', 'endpoint ok latency address error')
+
+DEFAULT_TIMEOUT = 3.0
+
+
+def resolve(host, port, transport='tcp'):
+    """Возвращает первый адрес сервера (family, sockaddr)"""
+    socktype = socket.SOCK_DGRAM if transport == 'udp' else socket.SOCK_STREAM
+    family, _, _, _, sockaddr = socket.getaddrinfo(host, port, 0, socktype)[0]
+    return family, sockaddr
+
+
+def probe_endpoint(endpoint, timeout=DEFAULT_TIMEOUT):
+    """Проверяет один сервер: DNS и TCP-подключение (для UDP только DNS)"""
+    try:
+        family, sockaddr = resolve(endpoint.host, endpoint.port, endpoint.transport)
+    except (OSError, UnicodeError) as e:
+        return ProbeResult(endpoint, False, None, None, f'dns: {e}')
+    if endpoint.transport == 'udp':
+        return ProbeResult(endpoint, True, None, sockaddr[0], '')
+    start = time.perf_counter()
+    try:
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(sockaddr)
+    except OSError as e:
+        return ProbeResult(endpoint, False, None, sockaddr[0], f'tcp: {e}')
+    return ProbeResult(endpoint, True, time.perf_counter() - start, sockaddr[0], '')
+
+
+def _tls_handshake(sock, server_name, timeout):
+    import ssl
+    context = ssl.create_default_context()
+    # Нужна только проверка, что на порту отвечает TLS, сертификат проверит сам протокол
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    sock.settimeout(timeout)
+    with context.wrap_socket(sock, server_hostname=server_name) as tls:
+        return tls.version()
+
+
+def _udp_check(family, sockaddr, timeout):
+    """Пустая датаграмма: ICMP port unreachable дает ConnectionRefusedError"""
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(sockaddr)
+        sock.send(b'')
+        try:
+            sock.recv(1)
+        except socket.timeout:
+            return 'нет ответа'
+        return 'ответ получен'
+
+
+def preflight_endpoint(endpoint, timeout=DEFAULT_TIMEOUT):
+    """Полная проверка сервера: DNS, TCP или UDP, рукопожатие TLS где возможно"""
+    try:
+        family, sockaddr = resolve(endpoint.host, endpoint.port, endpoint.transport)
+    except (OSError, UnicodeError) as e:
+        return ProbeResult(endpoint, False, None, None, f'dns: {e}')
+    address = sockaddr[0]
+    if endpoint.transport == 'udp':
+        try:
+            detail = _udp_check(family, sockaddr, min(timeout, 1.0))
+        except OSError as e:
+            return ProbeResult(endpoint, False, None, address, f'udp: {e}')
+        return ProbeResult(endpoint, True, None, address, detail)
+    stage = 'tcp'
+    detail = ''
+    start = time.perf_counter()
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(sockaddr)
+        latency = time.perf_counter() - start
+        if endpoint.security == 'tls':
+            stage = 'tls'
+            detail = _tls_handshake(sock, endpoint.host, timeout)
+    except OSError as e:
+        return ProbeResult(endpoint, False, None, address, f'{stage}: {e}')
+    finally:
+        sock.close()
+    return ProbeResult(endpoint, True, latency, address, detail)
+
+
+def probe_many(endpoints, timeout=DEFAULT_TIMEOUT, workers=8):
+    """Проверяет серверы параллельно и отдает результаты по мере готовности"""
+    endpoints = list(endpoints)
+    if not endpoints:
+        return
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    with ThreadPoolExecutor(max_workers=min(workers, len(endpoints))) as pool:
+        futures = [pool.submit(probe_endpoint, ep, timeout) for ep in endpoints]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def rank_key(result):
+    """Ключ сортировки: доступные с меньшей задержкой первыми"""
+    if not result.ok:
+        return (2, 0.0)
+    if result.latency is None:
+        return (1, 0.0)
+    return (0, result.latency)
@@ -0,0 +1,33 @@
+"""Список регионов и сопоставление серверов с регионами"""
+import os
+
+from .paths import get_data_dir
+
+# Регион и имя файла флага
+REGIONS = [
+    ('USA', 's1.png'),
+    ('UNITED KINGDOM', 's5.png'),
+    ('GERMANY', 's6.png'),
+    ('JAPAN', 's4.png'),
+    ('CANADA', 's3.png'),
+    ('FRANCE', 's2.png'),
+]
+
+DEFAULT_REGION = 'USA'
+
+
+def flag_path(flag_file):
+    """Путь к файлу флага"""
+    return os.path.join(get_data_dir(), 'flags', flag_file)
+
+
+def region_names():
+    return [name for name, _ in REGIONS]
+
+
+def endpoints_for_region(endpoints, region):
+    """Серверы, в имени которых упоминается регион"""
+    if not region:
+        return list(endpoints)
+    key = region.lower()
+    return [ep for ep in endpoints if key in (ep.name or '').lower()]
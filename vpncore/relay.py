@@ -0,0 +1,286 @@
+"""Локальный ретранслятор TCP: принимает подключения и пересылает их на сервер VPN"""
+import asyncio
+import threading
+import time
+
+from .accounting import AccountingFull
+from .compression import FRAME, MAX_FRAME, CompressionStats, FlowDecoder, FlowEncoder, get_codec
+from .control import DEFAULT_RELAY_PORT
+
+
+# Пауза в передаче длиннее этой не входит в активное время потока
+IDLE_GAP = 0.5
+
+
+class FlowTimer:
+    """Время активной передачи потока: простои keep-alive соединения не считаются"""
+    __slots__ = ('last', 'active')
+
+    def __init__(self):
+        self.last = None
+        self.active = 0.0
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.last is not None:
+            self.active += min(now - self.last, IDLE_GAP)
+        self.last = now
+
+
+class Relay:
+    """Пересылает каждое входящее подключение на upstream.
+
+    upstream - (host, port) или функция без аргументов, возвращающая (host, port).
+    compression - 'compress' (сжимать к upstream, клиентская сторона) или
+    'decompress' (принимать сжатые потоки, сторона второго ретранслятора).
+    """
+    # Замерять активное время потоков для flow_closed (нужно оценке путей в bonding)
+    measure_activity = False
+
+    def __init__(self, upstream, host='127.0.0.1', port=DEFAULT_RELAY_PORT, accounting=None,
+                 buffer_size=65536, connect_timeout=10.0, backlog=1024, compression=None, codec='zlib'):
+        self.upstream = upstream
+        self.host = host
+        self.port = port
+        self.accounting = accounting
+        self.buffer_size = buffer_size
+        self.connect_timeout = connect_timeout
+        # Очередь asyncio по умолчанию (100) под пачкой подключений дает повторы SYN через секунду
+        self.backlog = backlog
+        self.compression = compression
+        self.codec = get_codec(codec) if compression else None
+        self.compression_stats = CompressionStats()
+        self.server = None
+        self.active_flows = 0
+        self.total_flows = 0
+        self.failed_flows = 0
+        self._handlers = set()
+        self._writers = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port, backlog=self.backlog)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        # Закрытие сокетов завершает пересылку штатно, без отмены задач
+        for writer in list(self._writers):
+            writer.close()
+        if self._handlers:
+            await asyncio.wait(list(self._handlers), timeout=1.0)
+
+    def target(self):
+        return self.upstream() if callable(self.upstream) else self.upstream
+
+    async def open_upstream(self, flow_id):
+        """Открывает соединение с сервером; точка расширения для других стратегий"""
+        host, port = self.target()
+        return await asyncio.wait_for(asyncio.open_connection(host, port), self.connect_timeout)
+
+    def _open_flow(self, writer):
+        if self.accounting is None:
+            return None
+        try:
+            # Владелец ищется пачкой в фоновом потоке учета, не в цикле событий
+            return self.accounting.open_flow(writer.get_extra_info('peername'), writer.get_extra_info('sockname'))
+        except AccountingFull:
+            return None
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        self._writers.add(writer)
+        try:
+            await self._forward(reader, writer)
+        finally:
+            self._handlers.discard(task)
+            self._writers.discard(writer)
+
+    async def _forward(self, reader, writer):
+        self.total_flows += 1
+        flow_id = self._open_flow(writer)
+        try:
+            up_reader, up_writer = await self.open_upstream(flow_id)
+        except (OSError, asyncio.TimeoutError):
+            self.failed_flows += 1
+            writer.close()
+            if flow_id is not None:
+                self.accounting.close_flow(flow_id)
+            return
+        self._writers.add(up_writer)
+        self.active_flows += 1
+        up_counters = self.accounting.up if flow_id is not None else None
+        down_counters = self.accounting.down if flow_id is not None else None
+        if self.compression == 'compress':
+            up_pipe, down_pipe = self.pipe_encode, self.pipe_decode
+        elif self.compression == 'decompress':
+            up_pipe, down_pipe = self.pipe_decode, self.pipe_encode
+        else:
+            up_pipe = down_pipe = self.pipe
+        start = time.perf_counter()
+        timer = FlowTimer() if self.measure_activity else None
+        moved = (0, 0)
+        try:
+            moved = await asyncio.gather(
+                up_pipe(reader, up_writer, up_counters, flow_id, timer),
+                down_pipe(up_reader, writer, down_counters, flow_id, timer),
+            )
+        finally:
+            writer.close()
+            up_writer.close()
+            self._writers.discard(up_writer)
+            self.active_flows -= 1
+            if flow_id is not None:
+                self.accounting.close_flow(flow_id)
+            elapsed = timer.active if timer is not None else time.perf_counter() - start
+            self.flow_closed(up_writer, sum(moved), elapsed)
+
+    def flow_closed(self, up_writer, nbytes, elapsed):
+        """Вызывается после закрытия потока; точка расширения для статистики путей.
+
+        elapsed - время жизни потока, а при measure_activity - время активной передачи.
+        """
+
+    async def pipe(self, reader, writer, counters, flow_id, timer=None):
+        """Копирует данные в одну сторону, считая байты в counters[flow_id].
+
+        timer (FlowTimer) отмечает моменты передачи. Возвращает число скопированных байт.
+        """
+        copied = 0
+        try:
+            while True:
+                data = await reader.read(self.buffer_size)
+                if not data:
+                    break
+                copied += len(data)
+                if counters is not None:
+                    counters[flow_id] += len(data)
+                if timer is not None:
+                    timer.tick()
+                writer.write(data)
+                await writer.drain()
+            # Полузакрытие: вторая сторона еще может дописать ответ
+            self._write_eof(writer)
+        except (ConnectionError, OSError):
+            writer.close()
+        return copied
+
+    @staticmethod
+    def _write_eof(writer):
+        if writer.can_write_eof():
+            writer.write_eof()
+        else:
+            writer.close()
+
+    async def pipe_encode(self, reader, writer, counters, flow_id, timer=None):
+        """Как pipe, но отправляет кадры сжатия"""
+        encoder = FlowEncoder(self.codec, self.compression_stats)
+        copied = 0
+        try:
+            writer.write(encoder.preamble())
+            while True:
+                data = await reader.read(self.buffer_size)
+                if not data:
+                    break
+                copied += len(data)
+                if counters is not None:
+                    counters[flow_id] += len(data)
+                if timer is not None:
+                    timer.tick()
+                writer.write(encoder.encode(data))
+                await writer.drain()
+            self._write_eof(writer)
+        except (ConnectionError, OSError, ValueError):
+            # ValueError - сбой кодека; поток закрывается, а не падает в цикле событий
+            writer.close()
+        return copied
+
+    async def pipe_decode(self, reader, writer, counters, flow_id, timer=None):
+        """Принимает кадры сжатия и пишет распакованные данные"""
+        copied = 0
+        try:
+            preamble = await reader.readexactly(1)
+            decoder = FlowDecoder(preamble[0], self.compression_stats)
+            while True:
+                try:
+                    header = await reader.readexactly(FRAME.size)
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        raise
+                    break
+                kind, length = FRAME.unpack(header)
+                if length > MAX_FRAME:
+                    raise ValueError(f'Слишком большой кадр: {length}')
+                data = decoder.decode(kind, await reader.readexactly(length))
+                copied += len(data)
+                if counters is not None:
+                    counters[flow_id] += len(data)
+                if timer is not None:
+                    timer.tick()
+                writer.write(data)
+                await writer.drain()
+            self._write_eof(writer)
+        except asyncio.IncompleteReadError as e:
+            # Поток закрыт до первого кадра - обычное пустое соединение
+            if e.partial or copied:
+                writer.close()
+            else:
+                self._write_eof(writer)
+        except (ConnectionError, OSError, ValueError, ImportError):
+            # ImportError - кодек другой стороны здесь не установлен
+            writer.close()
+        return copied
+
+    def stats(self):
+        return {
+            'port': self.port,
+            'active_flows': self.active_flows,
+            'total_flows': self.total_flows,
+            'failed_flows': self.failed_flows,
+            'compression': self.compression_stats.snapshot() if self.compression else None,
+        }
+
+
+class RelayThread:
+    """Запускает Relay в собственном цикле событий в фоновом потоке"""
+    def __init__(self, relay):
+        self.relay = relay
+        self.loop = None
+        self.thread = None
+        self.error = None
+        self._started = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self._started.wait()
+        if self.error is not None:
+            raise self.error
+        return self.relay.port
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.relay.start())
+        except OSError as e:
+            self.error = e
+            self._started.set()
+            self.loop.close()
+            return
+        self._started.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    def call(self, coro, timeout=10.0):
+        """Выполняет корутину в цикле ретранслятора и ждет результат"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self):
+        if self.loop is None or self.error is not None:
+            return
+        self.call(self.relay.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
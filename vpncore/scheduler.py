@@ -0,0 +1,173 @@
+"""Единый планировщик периодических задач с классами приоритета и режимами питания"""
+import threading
+import time
+
+# Классы приоритета: чем больше число, тем раньше задачу замедляют или останавливают
+CRITICAL = 0
+NORMAL = 1
+IDLE = 2
+UI = 3
+
+PRIORITY_NAMES = {CRITICAL: 'critical', NORMAL: 'normal', IDLE: 'idle', UI: 'ui'}
+
+# Множитель интервала для каждого режима; None - задача приостановлена
+RATE_POLICY = {
+    'foreground': {CRITICAL: 1, NORMAL: 1, IDLE: 1, UI: 1},
+    'battery_saver': {CRITICAL: 1, NORMAL: 2, IDLE: 4, UI: 2},
+    'overloaded': {CRITICAL: 1, NORMAL: 2, IDLE: None, UI: 2},
+    'background': {CRITICAL: 1, NORMAL: 4, IDLE: None, UI: None},
+}
+
+
+class Task:
+    """Периодическая задача и ее статистика"""
+    def __init__(self, name, callback, interval, priority, next_run):
+        self.name = name
+        self.callback = callback
+        self.interval = interval
+        self.priority = priority
+        self.next_run = next_run
+        self.delay = interval
+        self.runs = 0
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+        self.errors = 0
+        self.last_error = ''
+
+
+class TaskScheduler:
+    """Запускает задачи по сроку, объединяя близкие таймеры в один проход.
+
+    Если callback возвращает число, это следующий интервал задачи в секундах
+    (до применения множителя текущего режима).
+    """
+    def __init__(self, clock=time.monotonic, coalesce_window=0.25, frame_budget=0.008):
+        self.clock = clock
+        self.coalesce_window = coalesce_window
+        self.frame_budget = frame_budget
+        self.tasks = {}
+        self.paused = False
+        self.battery_saver = False
+        self.overloaded = False
+        self._listeners = []
+        self._lock = threading.RLock()
+
+    def add_listener(self, callback):
+        """callback() вызывается, когда меняется ближайший срок (нужно перепланировать таймер)"""
+        self._listeners.append(callback)
+
+    def _changed(self):
+        for callback in list(self._listeners):
+            callback()
+
+    @property
+    def mode(self):
+        if self.paused:
+            return 'background'
+        if self.overloaded:
+            return 'overloaded'
+        if self.battery_saver:
+            return 'battery_saver'
+        return 'foreground'
+
+    def multiplier(self, priority):
+        return RATE_POLICY[self.mode][priority]
+
+    def register(self, name, callback, interval, priority=NORMAL, run_now=False):
+        """Регистрирует задачу; повторная регистрация с тем же именем заменяет ее"""
+        with self._lock:
+            now = self.clock()
+            self.tasks[name] = Task(name, callback, interval, priority, now if run_now else now + interval)
+        self._changed()
+        return self.tasks[name]
+
+    def unregister(self, name):
+        with self._lock:
+            self.tasks.pop(name, None)
+        self._changed()
+
+    def set_state(self, paused=None, battery_saver=None, overloaded=None):
+        """Меняет режим; при возврате в активный режим задачи не ждут старых сроков"""
+        with self._lock:
+            old_mode = self.mode
+            if paused is not None:
+                self.paused = paused
+            if battery_saver is not None:
+                self.battery_saver = battery_saver
+            if overloaded is not None:
+                self.overloaded = overloaded
+            if self.mode == old_mode:
+                return
+            now = self.clock()
+            for task in self.tasks.values():
+                factor = self.multiplier(task.priority)
+                if factor is not None:
+                    task.next_run = min(task.next_run, now + task.delay * factor)
+        self._changed()
+
+    def _runnable(self, now):
+        horizon = now + self.coalesce_window
+        due = [t for t in self.tasks.values()
+               if self.multiplier(t.priority) is not None and t.next_run <= horizon]
+        due.sort(key=lambda t: (t.priority, t.next_run))
+        return due
+
+    def run_due(self):
+        """Выполняет назревшие задачи; некритичные переносятся, если исчерпан бюджет кадра"""
+        start = self.clock()
+        with self._lock:
+            due = self._runnable(start)
+        for task in due:
+            if task.priority != CRITICAL and self.clock() - start > self.frame_budget:
+                break
+            self._run(task)
+        return len(due)
+
+    def _run(self, task):
+        cpu_start = time.thread_time()
+        wall_start = self.clock()
+        delay = None
+        try:
+            delay = task.callback()
+        except Exception as e:
+            task.errors += 1
+            task.last_error = str(e)
+        now = self.clock()
+        task.runs += 1
+        task.cpu_time += time.thread_time() - cpu_start
+        task.wall_time += now - wall_start
+        task.delay = delay if isinstance(delay, (int, float)) else task.interval
+        factor = self.multiplier(task.priority) or 1
+        task.next_run = now + task.delay * factor
+
+    def next_wakeup(self, default=60.0):
+        """Через сколько секунд нужен следующий проход"""
+        with self._lock:
+            pending = [t.next_run for t in self.tasks.values() if self.multiplier(t.priority) is not None]
+        if not pending:
+            return default
+        return max(0.0, min(pending) - self.clock())
+
+    def stats(self):
+        """Статистика по задачам, включая процессорное время"""
+        with self._lock:
+            return [{
+                'task': t.name,
+                'priority': PRIORITY_NAMES[t.priority],
+                'interval': t.interval,
+                'runs': t.runs,
+                'cpu_ms': round(t.cpu_time * 1000, 2),
+                'avg_cpu_ms': round(t.cpu_time * 1000 / t.runs, 3) if t.runs else 0.0,
+                'wall_ms': round(t.wall_time * 1000, 2),
+                'errors': t.errors,
+                'suspended': self.multiplier(t.priority) is None,
+            } for t in self.tasks.values()]
+
+    def run_forever(self, stop_event):
+        """Цикл для демона без Kivy"""
+        wakeup = threading.Event()
+        self.add_listener(wakeup.set)
+        while not stop_event.is_set():
+            self.run_due()
+            wakeup.clear()
+            wakeup.wait(min(self.next_wakeup(), 1.0))
@@ -0,0 +1,134 @@
+"""Состояние последней сессии для быстрого восстановления при запуске"""
+import json
+import os
+import threading
+import time
+
+from . import vault
+from .catalog import server_key
+
+
+# Поля с адресами серверов: при доступном шифровании хранятся только внутри 'sealed'
+SEALED_FIELDS = ('server', 'preferred', 'health', 'pins')
+SEALED_NAME = 'session'
+
+
+class SessionStore:
+    """Хранит регион, сервер, адрес, оценки серверов и факт подключения.
+
+    С vault (ConfigDatabase.vault) адреса серверов, оценки и закрепленные
+    записи шифруются тем же ключом, что и профили конфигурации.
+    """
+    def __init__(self, filepath, vault=None):
+        self.filepath = filepath
+        self.vault = vault
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.filepath, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def load(self):
+        """Загружает сохраненное состояние; при любой ошибке - пустое.
+
+        Зашифрованные поля ждут ключ, поэтому вызывать вне UI-потока.
+        """
+        data = self._read()
+        sealed = data.pop('sealed', None)
+        if sealed and self.vault is not None:
+            try:
+                fields = json.loads(self.vault.decrypt(sealed, SEALED_NAME))
+            except (vault.VaultError, ValueError):
+                fields = {}
+            if isinstance(fields, dict):
+                data.update((key, fields[key]) for key in SEALED_FIELDS if key in fields)
+        return data
+
+    def seal(self, state):
+        """Переносит поля с адресами в зашифрованную запись.
+
+        Открытым текстом эти поля на диск не попадают. Пока ключ не готов или
+        недоступен, остается прежняя запись из файла: иначе после одного сбоя
+        хранилища ключей избранное, недавние и оценки пропали бы насовсем.
+        """
+        if self.vault is None:
+            return state
+        state = dict(state)
+        fields = {key: state.pop(key) for key in SEALED_FIELDS if key in state}
+        sealed = None
+        if self.vault.ready:
+            try:
+                sealed = self.vault.encrypt(json.dumps(fields, ensure_ascii=False), SEALED_NAME)
+            except vault.VaultError:
+                pass
+        if sealed is None:
+            sealed = self._read().get('sealed')
+        if sealed is not None:
+            state['sealed'] = sealed
+        return state
+
+    def save(self, state):
+        """Атомарно записывает состояние (через временный файл)"""
+        state = dict(self.seal(state), saved_at=time.time())
+        tmp_path = self.filepath + '.tmp'
+        with self._lock:
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, ensure_ascii=False)
+                os.replace(tmp_path, self.filepath)
+                return True
+            except OSError:
+                return False
+
+
+def capture_session(manager, auto_reconnect=True, catalog=None):
+    """Снимок состояния ConnectionManager, монитора серверов и закрепленных записей каталога"""
+    endpoint = manager.endpoint
+    state = {
+        'region': manager.region,
+        'connected': manager.connected,
+        'auto_reconnect': auto_reconnect,
+        'server': {
+            'protocol': endpoint.protocol,
+            'host': endpoint.host,
+            'port': endpoint.port,
+            'address': manager.address,
+        } if endpoint else None,
+        'health': manager.health.export_scores() if manager.health is not None else {},
+        'preferred': server_key(manager.preferred) if manager.preferred else None,
+    }
+    if catalog is not None:
+        state['pins'] = catalog.export_pins()
+    return state
+
+
+def _find_server(manager, key):
+    if not key:
+        return None
+    try:
+        endpoints = manager.endpoints()
+    except ValueError:
+        return None
+    return next((ep for ep in endpoints if server_key(ep) == key), None)
+
+
+def restore_session(manager, state, reconnect=True):
+    """Применяет сохраненное состояние; при необходимости переподключается.
+
+    Возвращает True, если подключение восстановлено. Вызывать вне UI-потока.
+    """
+    if state.get('region'):
+        manager.set_region(state['region'], _find_server(manager, state.get('preferred')))
+    if manager.health is not None and state.get('health'):
+        try:
+            manager.health.set_endpoints(manager.endpoints())
+        except ValueError:
+            return False
+        manager.health.restore_scores(state['health'])
+    if not (reconnect and state.get('connected') and state.get('auto_reconnect', True)):
+        return False
+    return manager.reconnect(state.get('server'))
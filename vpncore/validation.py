@@ -0,0 +1,164 @@
+"""Проверка конфигурации перед сохранением: разбор и параллельный preflight серверов"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .config import ConfigError, parse_config
+from .probe import DEFAULT_TIMEOUT, ProbeResult, preflight_endpoint
+
+# kind: 'parsed', 'probe' или 'done'; data: ParsedConfig, ProbeResult или ValidationReport
+ValidationEvent = namedtuple('ValidationEvent', 'kind data')
+
+
+class ValidationReport:
+    """Итог проверки конфигурации"""
+    def __init__(self, parsed=None, results=(), error='', timed_out=False):
+        self.parsed = parsed
+        self.results = list(results)
+        self.error = error
+        self.timed_out = timed_out
+        self.checked_at = time.time()
+
+    @property
+    def reachable(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def ok(self):
+        """Разобрана и хотя бы один сервер отвечает прямо сейчас"""
+        return self.parsed is not None and bool(self.reachable)
+
+    @property
+    def saveable(self):
+        """Сохранить можно любую разобранную конфигурацию: недоступность серверов -
+        предупреждение (сеть или сервер могут быть временно недоступны), не ошибка"""
+        return self.parsed is not None
+
+    def summary(self):
+        if self.parsed is None:
+            return self.error
+        total = len(self.parsed.endpoints)
+        text = f'Доступно серверов: {len(self.reachable)} из {total}'
+        if self.timed_out:
+            text += ' (время проверки истекло)'
+        return text
+
+
+def config_hash(text):
+    return hashlib.sha256(text.strip().encode('utf-8')).hexdigest()
+
+
+class ConfigValidator:
+    """Проверяет конфигурации и кэширует результаты по хэшу текста.
+
+    Разбор кэшируется всегда, отчет проверки серверов - только успешный.
+    """
+    def __init__(self, deadline=6.0, probe_timeout=DEFAULT_TIMEOUT, workers=16,
+                 preflight_ttl=300.0, cache_size=32):
+        self.deadline = deadline
+        self.probe_timeout = probe_timeout
+        self.workers = workers
+        self.preflight_ttl = preflight_ttl
+        self.cache_size = cache_size
+        self._parsed = OrderedDict()
+        self._reports = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, cache, key, value):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def parse(self, text):
+        """Разбор с кэшем; ConfigError тоже кэшируется"""
+        key = config_hash(text)
+        with self._lock:
+            cached = self._parsed.get(key)
+        if cached is None:
+            try:
+                cached = parse_config(text)
+            except ConfigError as e:
+                cached = e
+            self._remember(self._parsed, key, cached)
+        if isinstance(cached, ConfigError):
+            raise cached
+        return cached
+
+    def cached_report(self, text):
+        """Свежий отчет из кэша или None"""
+        with self._lock:
+            report = self._reports.get(config_hash(text))
+        if report and time.time() - report.checked_at < self.preflight_ttl:
+            return report
+        return None
+
+    def validate(self, text, on_event=None):
+        """Проверяет конфигурацию, сообщая on_event о каждом шаге по мере готовности"""
+        emit = on_event or (lambda event: None)
+        report = self.cached_report(text)
+        if report is not None:
+            if report.parsed is not None:
+                emit(ValidationEvent('parsed', report.parsed))
+            for result in report.results:
+                emit(ValidationEvent('probe', result))
+            emit(ValidationEvent('done', report))
+            return report
+
+        try:
+            parsed = self.parse(text)
+        except ConfigError as e:
+            report = ValidationReport(error=str(e))
+            emit(ValidationEvent('done', report))
+            return report
+        emit(ValidationEvent('parsed', parsed))
+
+        results, timed_out = self._preflight(parsed.endpoints, emit)
+        report = ValidationReport(parsed, results, timed_out=timed_out)
+        # Кэшируется только успешная проверка: после сбоя сети или сервера
+        # повторная попытка должна проверять заново, а не показывать старую ошибку
+        if report.ok and not timed_out:
+            self._remember(self._reports, config_hash(text), report)
+        emit(ValidationEvent('done', report))
+        return report
+
+    def _preflight(self, endpoints, emit):
+        results = []
+        unique = list(OrderedDict.fromkeys(endpoints))
+        if not unique:
+            return results, False
+        end = time.monotonic() + self.deadline
+        pool = ThreadPoolExecutor(max_workers=min(self.workers, len(unique)))
+        pending = {pool.submit(preflight_endpoint, ep, self.probe_timeout): ep for ep in unique}
+        try:
+            while pending:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.pop(future)
+                    result = future.result()
+                    results.append(result)
+                    emit(ValidationEvent('probe', result))
+        finally:
+            for future, ep in pending.items():
+                future.cancel()
+                result = ProbeResult(ep, False, None, None, 'время проверки истекло')
+                results.append(result)
+                emit(ValidationEvent('probe', result))
+            pool.shutdown(wait=False)
+        return results, bool(pending)
+
+    def validate_async(self, text, on_event=None, on_done=None):
+        """Запускает validate в фоновом потоке"""
+        def worker():
+            report = self.validate(text, on_event)
+            if on_done:
+                on_done(report)
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return thread
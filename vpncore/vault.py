@@ -0,0 +1,316 @@
+"""Шифрование профилей конфигурации (AES-GCM) с ключом из scrypt.
+
+Ключ выводится из секрета устройства функцией scrypt в фоновом потоке и
+кэшируется только в памяти процесса. Защита на диске не сильнее хранилища
+секрета: системное хранилище (keyring) или Android Keystore защищают, а
+запасной вариант - файл секрета рядом с данными - нет (см. KeyStore).
+Без пакета cryptography конфигурация хранится как раньше, открытым текстом.
+"""
+import base64
+import hashlib
+import os
+import threading
+import time
+
+from .paths import platform
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+SERVICE = 'ikisky-vpn'
+# Ключ в Android Keystore, которым зашифрован файл секрета; наружу не выдается
+ANDROID_ALIAS = 'ikisky-vpn-vault'
+WRAPPED_MAGIC = b'AKS1'
+GCM_TAG_BITS = 128
+KEY_SIZE = 32
+NONCE_SIZE = 12
+# Около 50-100 мс на телефоне: дорого для перебора, незаметно в фоне
+KDF_PARAMS = {'n': 2 ** 14, 'r': 8, 'p': 1}
+
+# Выведенные ключи на время жизни процесса: (соль, параметры) -> ключ
+_session_keys = {}
+_session_lock = threading.Lock()
+
+
+class VaultError(Exception):
+    """Ключ недоступен или данные повреждены"""
+
+
+def available():
+    return AESGCM is not None
+
+
+def b64encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def b64decode(text):
+    return base64.b64decode(text.encode('ascii'))
+
+
+def derive_key(secret, salt, n, r, p):
+    return hashlib.scrypt(secret, salt=salt, n=n, r=r, p=p, maxmem=128 * r * n * 2, dklen=KEY_SIZE)
+
+
+class AndroidKeyWrapper:
+    """Шифрует файл секрета неизвлекаемым ключом AES из Android Keystore (через jnius)"""
+    def __init__(self):
+        from jnius import autoclass
+        self._autoclass = autoclass
+        self._cipher = autoclass('javax.crypto.Cipher')
+        store = autoclass('java.security.KeyStore').getInstance('AndroidKeyStore')
+        store.load(None)
+        if not store.containsAlias(ANDROID_ALIAS):
+            self._generate()
+        self._key = store.getKey(ANDROID_ALIAS, None)
+
+    def _generate(self):
+        properties = self._autoclass('android.security.keystore.KeyProperties')
+        builder = self._autoclass('android.security.keystore.KeyGenParameterSpec$Builder')
+        spec = (builder(ANDROID_ALIAS, properties.PURPOSE_ENCRYPT | properties.PURPOSE_DECRYPT)
+                .setBlockModes([properties.BLOCK_MODE_GCM])
+                .setEncryptionPaddings([properties.ENCRYPTION_PADDING_NONE])
+                .setKeySize(256)
+                .build())
+        generator = self._autoclass('javax.crypto.KeyGenerator').getInstance(
+            properties.KEY_ALGORITHM_AES, 'AndroidKeyStore')
+        generator.init(spec)
+        generator.generateKey()
+
+    @staticmethod
+    def _bytes(java_array):
+        return bytes(b & 0xFF for b in java_array)
+
+    def wrap(self, secret):
+        cipher = self._cipher.getInstance('AES/GCM/NoPadding')
+        # IV выбирает сам Keystore: свой IV ему передать нельзя
+        cipher.init(self._cipher.ENCRYPT_MODE, self._key)
+        iv = self._bytes(cipher.getIV())
+        return WRAPPED_MAGIC + bytes((len(iv),)) + iv + self._bytes(cipher.doFinal(secret))
+
+    def unwrap(self, data):
+        size = data[len(WRAPPED_MAGIC)]
+        start = len(WRAPPED_MAGIC) + 1
+        iv, body = data[start:start + size], data[start + size:]
+        spec = self._autoclass('javax.crypto.spec.GCMParameterSpec')(GCM_TAG_BITS, iv)
+        cipher = self._cipher.getInstance('AES/GCM/NoPadding')
+        cipher.init(self._cipher.DECRYPT_MODE, self._key, spec)
+        return self._bytes(cipher.doFinal(body))
+
+
+class KeyStore:
+    """Секрет устройства, из которого выводится ключ шифрования.
+
+    Где лежит секрет, по убыванию защиты:
+    - keyring - системное хранилище (Keychain, Credential Manager, Secret Service);
+    - Android - файл в каталоге приложения, зашифрованный ключом из Android
+      Keystore: копия каталога данных без устройства профили не раскрывает;
+    - иначе - файл с правами 0600 рядом с конфигурацией. Это НЕ защита на
+      диске: кто может прочитать каталог данных, тот расшифрует и профили.
+      Шифрование тогда защищает только от утечки одного файла конфигурации.
+    """
+    def __init__(self, directory, use_keyring=True):
+        self.secret_path = os.path.join(directory, '.vault_secret')
+        # keyring и jnius импортируются лениво, в потоке разблокировки, а не при запуске
+        self._use_keyring = use_keyring
+        self._ring = None
+        self._ring_checked = False
+        self._wrapper = None
+        self._wrapper_checked = False
+
+    @property
+    def _keyring(self):
+        if not self._ring_checked:
+            self._ring_checked = True
+            if self._use_keyring:
+                try:
+                    import keyring
+                    # У заглушки keyring.backends.fail приоритет 0: хранилища нет
+                    if keyring.get_keyring().priority > 0:
+                        self._ring = keyring
+                except Exception:
+                    self._ring = None
+        return self._ring
+
+    @property
+    def _android(self):
+        if not self._wrapper_checked:
+            self._wrapper_checked = True
+            if platform == 'android':
+                try:
+                    self._wrapper = AndroidKeyWrapper()
+                except Exception:
+                    self._wrapper = None
+        return self._wrapper
+
+    @property
+    def backend(self):
+        if self._keyring is not None:
+            return 'keyring'
+        return 'android-keystore' if self._android is not None else 'file'
+
+    @property
+    def protected(self):
+        """False - секрет лежит открыто рядом с данными и на диске ничего не защищает"""
+        return self.backend != 'file'
+
+    def _get(self, name):
+        """Значение из keyring или None, если записи нет.
+
+        Ошибка хранилища - VaultError, а не None: иначе secret() принял бы
+        недоступное хранилище за пустое и затер бы настоящий секрет новым.
+        """
+        try:
+            value = self._keyring.get_password(SERVICE, name)
+        except Exception as e:
+            raise VaultError(f'Хранилище ключей недоступно: {e}') from e
+        return b64decode(value) if value else None
+
+    def _set(self, name, value):
+        try:
+            self._keyring.set_password(SERVICE, name, b64encode(value))
+            return True
+        except Exception:
+            return False
+
+    def _read_secret_file(self):
+        """Секрет из файла или None, если файла нет"""
+        try:
+            with open(self.secret_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        wrapped = data.startswith(WRAPPED_MAGIC)
+        if wrapped:
+            if self._android is None:
+                raise VaultError('Файл секрета зашифрован Android Keystore, а он недоступен')
+            try:
+                data = self._android.unwrap(data)
+            except Exception as e:
+                raise VaultError(f'Android Keystore не расшифровал секрет: {e}') from e
+        if len(data) != KEY_SIZE:
+            raise VaultError(f'Поврежден файл секрета {self.secret_path}')
+        if not wrapped and self._android is not None:
+            # Открытый секрет прежних версий перешифровывается ключом Keystore
+            self._write_secret_file(data)
+        return data
+
+    def _write_secret_file(self, secret):
+        data = secret
+        if self._android is not None:
+            try:
+                data = self._android.wrap(secret)
+            except Exception:
+                # Без Keystore секрет все равно нужен, иначе профили не сохранить
+                data = secret
+        tmp_path = self.secret_path + '.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.secret_path)
+
+    def secret(self):
+        """Секрет устройства; создается, только если его точно нет нигде"""
+        if self._keyring is None:
+            secret = self._read_secret_file()
+            if secret is None:
+                secret = os.urandom(KEY_SIZE)
+                self._write_secret_file(secret)
+            return secret
+        secret = self._get('secret')
+        if secret is not None:
+            return secret
+        secret = self._read_secret_file()
+        if secret is not None:
+            # Секрет из файла (без keyring или после сбоя записи) переносится в keyring;
+            # файл удаляется, только когда keyring вернул то же значение
+            if self._set('secret', secret) and self._get('secret') == secret:
+                os.remove(self.secret_path)
+            return secret
+        secret = os.urandom(KEY_SIZE)
+        if not self._set('secret', secret):
+            self._write_secret_file(secret)
+        return secret
+
+    def forget_cached_key(self, salt):
+        """Удаляет выведенный ключ, который прежние версии хранили в keyring рядом с секретом"""
+        if self._keyring is None:
+            return
+        try:
+            if self._get('key:' + b64encode(salt)) is not None:
+                self._keyring.delete_password(SERVICE, 'key:' + b64encode(salt))
+        except Exception:
+            pass
+
+
+class Vault:
+    """Ключ шифрования, который готовится в фоне, и операции AES-GCM"""
+    def __init__(self, keystore, salt=None, params=None):
+        self.keystore = keystore
+        self.salt = salt or os.urandom(16)
+        self.params = dict(params or KDF_PARAMS)
+        self.unlock_time = None
+        self.error = None
+        self._key = None
+        self._ready = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def kdf_info(self):
+        return dict(self.params, salt=b64encode(self.salt))
+
+    def unlock_async(self):
+        """Запускает вывод ключа в фоновом потоке (один раз)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._unlock, daemon=True).start()
+
+    def _unlock(self):
+        start = time.perf_counter()
+        cache_id = (self.salt, tuple(sorted(self.params.items())))
+        try:
+            with _session_lock:
+                key = _session_keys.get(cache_id)
+            if key is None:
+                # Выведенный ключ на диск не кэшируется: рядом с секретом он обесценил бы KDF
+                key = derive_key(self.keystore.secret(), self.salt, **self.params)
+                self.keystore.forget_cached_key(self.salt)
+            with _session_lock:
+                _session_keys[cache_id] = key
+            self._key = AESGCM(key)
+        except (OSError, ValueError, VaultError) as e:
+            self.error = str(e)
+        self.unlock_time = time.perf_counter() - start
+        self._ready.set()
+
+    @property
+    def ready(self):
+        """Ключ выведен (или вывод завершился ошибкой): key() не будет ждать"""
+        return self._ready.is_set()
+
+    def key(self, timeout=30.0):
+        self.unlock_async()
+        if not self._ready.wait(timeout):
+            raise VaultError('Ключ не готов')
+        if self._key is None:
+            raise VaultError(self.error or 'Ключ недоступен')
+        return self._key
+
+    def encrypt(self, plaintext, name):
+        """Запись профиля; имя профиля входит в аутентифицированные данные"""
+        nonce = os.urandom(NONCE_SIZE)
+        data = self.key().encrypt(nonce, plaintext.encode('utf-8'), name.encode('utf-8'))
+        return {'nonce': b64encode(nonce), 'data': b64encode(data)}
+
+    def decrypt(self, record, name):
+        try:
+            plaintext = self.key().decrypt(b64decode(record['nonce']), b64decode(record['data']), name.encode('utf-8'))
+        except VaultError:
+            raise
+        except Exception as e:
+            raise VaultError(f'Профиль {name} не расшифрован') from e
+        return plaintext.decode('utf-8')